@@ -0,0 +1,99 @@
+from typing import Dict, List, Optional
+import asyncio
+import threading
+
+from peewee import chunked
+
+from askadmin.db.base import db
+from askadmin.db.models import QAAnalytics
+from configs import logger
+from configs.asksjtu_config import QA_ANALYTICS_BATCH_SIZE, QA_ANALYTICS_FLUSH_INTERVAL
+
+
+class QAAnalyticsWriter:
+    """
+    Buffer QAAnalytics rows in memory and write them with `insert_many` from a
+    background task, either when `batch_size` rows are pending or every
+    `flush_interval` seconds. Call `start` / `stop` from the app's startup and
+    shutdown hooks; `stop` flushes whatever is still buffered.
+    """
+
+    # sqlite allows at most 999 variables per statement, QAAnalytics has 7 columns
+    insert_chunk_size = 100
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def record(self, rows: List[Dict]):
+        """
+        queue rows for insertion. If the background task is not running
+        (e.g. outside of the app), rows are written immediately.
+        """
+        if not rows:
+            return
+        if self._task is None:
+            self._write(rows)
+            return
+        with self._lock:
+            self._buffer.extend(rows)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        self._write(rows)
+
+    def _write(self, rows: List[Dict]):
+        if not rows:
+            return
+        try:
+            with db.atomic():
+                for batch in chunked(rows, self.insert_chunk_size):
+                    QAAnalytics.insert_many(batch).execute()
+        except Exception as e:
+            logger.error(f"failed to write {len(rows)} QAAnalytics rows: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.to_thread(self.flush)
+
+
+qa_analytics_writer = QAAnalyticsWriter(
+    batch_size=QA_ANALYTICS_BATCH_SIZE,
+    flush_interval=QA_ANALYTICS_FLUSH_INTERVAL,
+)
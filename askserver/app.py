@@ -1,9 +1,12 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import argparse
 import uvicorn
 
 from askserver import knowledge_base, qa_collection
+from askserver.analytics import qa_analytics_writer
+from server.warmup import warmup_manager
 
 
 def create_app():
@@ -23,6 +26,24 @@ def create_app():
     )
     app.include_router(knowledge_base.router, prefix="/kb")
     app.include_router(qa_collection.router, prefix="/qa")
+
+    @app.get("/health")
+    async def health():
+        """预热完成后返回 200，预热中返回 503"""
+        return JSONResponse(warmup_manager.status(), status_code=200 if warmup_manager.ready else 503)
+
+    @app.on_event("startup")
+    async def start_analytics_writer():
+        qa_analytics_writer.start()
+
+    @app.on_event("startup")
+    async def start_warmup():
+        warmup_manager.start()
+
+    @app.on_event("shutdown")
+    async def stop_analytics_writer():
+        await qa_analytics_writer.stop()
+
     return app
 
 
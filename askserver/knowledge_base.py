@@ -31,6 +31,7 @@ from server.utils import (
     get_prompt_template,
     wrap_done,
     get_ChatOpenAI,
+    retrieval_executor,
 )
 from server.chat.utils import History
 from server.knowledge_base.utils import get_doc_path
@@ -46,6 +47,44 @@ class KnowledgeBaseChatDocs(BaseModel):
     content: str
 
 
+def retrieve_chat_context(
+    query: str,
+    knowledge_base_name: str,
+    top_k: int,
+    score_threshold: float,
+    prompt_name: str,
+) -> dict:
+    """检索知识库并构造对话所需的上下文，包含阻塞操作，需在 retrieval_executor 中运行"""
+    docs = search_docs(query, knowledge_base_name, top_k, score_threshold)
+    # TODO: 优化一下结构
+    context = "\n".join([doc.page_content for doc in docs])
+
+    prompt_template = get_prompt_template(
+        "knowledge_base_chat", prompt_name, knowledge_base_name
+    )
+
+    source_documents = []
+    for inum, doc in enumerate(docs):
+        filename = Path(doc.metadata["source"]).name
+        text = f"""出处 [{inum + 1}] **{str(filename)}** \n\n{doc.page_content}\n\n"""
+        source_documents.append(text)
+
+    doc_path = get_doc_path(knowledge_base_name)
+    source_documents_json = [
+        dict(
+            filename=str(Path(doc.metadata["source"]).resolve().relative_to(doc_path)),
+            content=doc.page_content,
+        )
+        for doc in docs
+    ]
+    return dict(
+        context=context,
+        prompt_template=prompt_template,
+        source_documents=source_documents,
+        source_documents_json=source_documents_json,
+    )
+
+
 class KnowledgeBaseChatResponse(BaseModel):
     """ChatStreamResponse model"""
 
@@ -81,6 +120,20 @@ def download_knowledge_base_file(
     return FileResponse(file_path, filename=file_path.name)
 
 
+@router.get("/retrieval_stats")
+def retrieval_stats():
+    """检索线程池的运行状态，包括正在运行、排队和等待中的任务数"""
+    return retrieval_executor.stats()
+
+
+@router.get("/cache_stats")
+def cache_stats():
+    """向量库缓存的命中率、淘汰次数、加载耗时与内存占用"""
+    from server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool
+
+    return kb_faiss_pool.stats()
+
+
 @router.post(
     "/chat",
     responses={
@@ -110,7 +163,9 @@ async def knowledge_base_chat(
     stream: bool = Body(False, description="是否启用流式输出"),
     request: Request = None,
 ):
-    kb: Optional[KnowledgeBase] = KnowledgeBase.get_or_none(slug=knowledge_base_slug)
+    kb: Optional[KnowledgeBase] = await retrieval_executor.run(
+        KnowledgeBase.get_or_none, slug=knowledge_base_slug
+    )
     if kb is None:
         return JSONResponse(
             status_code=404, content={"error": f"未找到知识库 {knowledge_base_slug}"}
@@ -135,13 +190,19 @@ async def knowledge_base_chat(
             max_tokens=max_tokens,
             callbacks=[callback],
         )
-        docs = search_docs(query, kb.name, top_k, score_threshold)
-        # TODO: 优化一下结构
-        context = "\n".join([doc.page_content for doc in docs])
-
-        prompt_template = get_prompt_template(
-            "knowledge_base_chat", prompt_name, knowledge_base_name
+        retrieved = await retrieval_executor.run(
+            retrieve_chat_context,
+            query,
+            knowledge_base_name,
+            top_k,
+            score_threshold,
+            prompt_name,
         )
+        context = retrieved["context"]
+        source_documents = retrieved["source_documents"]
+        source_documents_json = retrieved["source_documents_json"]
+
+        prompt_template = retrieved["prompt_template"]
         input_msg = History(role="user", content=prompt_template).to_msg_template(False)
         chat_prompt = ChatPromptTemplate.from_messages(
             [i.to_msg_template() for i in history] + [input_msg]
@@ -156,21 +217,6 @@ async def knowledge_base_chat(
             ),
         )
 
-        source_documents = []
-        for inum, doc in enumerate(docs):
-            filename = Path(doc.metadata["source"]).name
-            text = f"""出处 [{inum + 1}] **{str(filename)}** \n\n{doc.page_content}\n\n"""
-            source_documents.append(text)
-
-        doc_path = get_doc_path(knowledge_base_name)
-        source_documents_json = [
-            dict(
-                filename=str(Path(doc.metadata["source"]).resolve().relative_to(doc_path)),
-                content=doc.page_content,
-            )
-            for doc in docs
-        ]
-
         if stream:
             # dump docs_json first to avoid blocking, add empty "answer" for compatibility
             yield json.dumps(
@@ -12,12 +12,13 @@ from typing import List, Optional, Annotated
 from datetime import datetime
 import uuid
 
-from askadmin.db.models import QA, QAAnalytics, QACollection
+from askadmin.db.models import QA, QACollection
 from configs import (
     VECTOR_SEARCH_TOP_K,
     SCORE_THRESHOLD,
 )
 from server.knowledge_base.kb_doc_api import search_docs
+from askserver.analytics import qa_analytics_writer
 
 router = APIRouter()
 
@@ -39,6 +40,27 @@ class QAQueryResponse(BaseModel):
     qas: List[QAQueryResponseItem] = Field(..., description="问题-答案对列表")
 
 
+def qa_from_metadata(doc) -> Optional[dict]:
+    """
+    Rebuild the question/answer pair stored by `qa_to_document`, or return
+    None if the document is legacy and must be read from the database.
+
+    Only documents carrying `alias` were written by the current
+    `qa_to_document`, which is re-run on every question/answer change. Older
+    documents were only re-vectorized on alias changes, so their question and
+    answer metadata may be stale.
+    """
+    metadata = doc.metadata
+    if not all(key in metadata for key in ("question", "answer", "alias")):
+        return None
+    return dict(
+        id=int(metadata["qa_id"]),
+        question=metadata["question"],
+        answer=metadata["answer"],
+        alias=metadata["alias"],
+    )
+
+
 @router.post(
     "/query",
     responses={
@@ -87,20 +109,32 @@ async def qa_collection_query(
     if len(docs) == 0:
         return QAQueryResponse(qas=[], query=query, answer="")
 
-    # create response item
-    id_score_map = {int(doc.metadata["qa_id"]): doc.score for doc in docs}
-    if None in id_score_map.keys():
-        del id_score_map[None]
-
-    qa_ids = list(id_score_map.keys())
-    qas = QA.select().where(QA.id.in_(qa_ids))
-    qas_with_score = [(qa, id_score_map[qa.id]) for qa in qas]
-    sorted_qas_with_score = sorted(qas_with_score, key=lambda x: x[1])
+    # create response item from vector store metadata, see `qa_to_document`
+    qas_with_score = {}
+    for doc in docs:
+        if doc.metadata.get("qa_id") is None:
+            continue
+        qa_id = int(doc.metadata["qa_id"])
+        if qa_id not in qas_with_score or doc.score < qas_with_score[qa_id][1]:
+            qas_with_score[qa_id] = (qa_from_metadata(doc), doc.score)
+
+    # legacy documents (see `qa_from_metadata`) fall back to the database
+    legacy_ids = [qa_id for qa_id, (qa, _) in qas_with_score.items() if qa is None]
+    if legacy_ids:
+        for qa in QA.select().where(QA.id.in_(legacy_ids)):
+            qas_with_score[qa.id] = (
+                dict(id=qa.id, question=qa.question, answer=qa.answer, alias=qa.alias),
+                qas_with_score[qa.id][1],
+            )
+    sorted_qas_with_score = sorted(
+        [(qa, score) for qa, score in qas_with_score.values() if qa is not None],
+        key=lambda x: x[1],
+    )
     items = [
         QAQueryResponseItem(
-            question=qa.question,
-            answer=qa.answer,
-            alias=qa.alias,
+            question=qa["question"],
+            answer=qa["answer"],
+            alias=qa["alias"],
             score=score,
         )
         for qa, score in sorted_qas_with_score
@@ -118,15 +152,20 @@ async def qa_collection_query(
 
     # analysis response
     query_id = uuid.uuid4()
-    for idx, (qa, score) in enumerate(sorted_qas_with_score):
-        QAAnalytics.create(
-            qa=qa,
-            query=query,
-            query_id=query_id,
-            rank=idx + 1,
-            top_k=top_k,
-            timestamp=datetime.now(),
-            score=score,
-        )
+    timestamp = datetime.now()
+    qa_analytics_writer.record(
+        [
+            dict(
+                qa=qa["id"],
+                query=query,
+                query_id=query_id,
+                rank=idx + 1,
+                top_k=top_k,
+                timestamp=timestamp,
+                score=score,
+            )
+            for idx, (qa, score) in enumerate(sorted_qas_with_score)
+        ]
+    )
 
     return QAQueryResponse(qas=items, query=query, answer=items[0].answer)
@@ -1,4 +1,5 @@
 from datetime import datetime, date
+from functools import lru_cache
 from configs.asksjtu_config import (
     PROMPT,
     DEFAULT_COMMAND,
@@ -33,12 +34,10 @@ def get_today_str() -> str:
     return today.strftime(r"%Y年%m月%d日")
 
 
-def format_prompt_template(template: str = PROMPT, command: str = DEFAULT_COMMAND) -> str:
+@lru_cache(maxsize=256)
+def _format_prompt_template(template: str, command: str, today: date) -> str:
     """
-    生成 prompt 模板，目前支持的变量有：
-    - study_year_info: 学年信息
-    - semester_info: 学期信息
-    - date: 今天的日期
+    以日期作为缓存键的一部分，学年、学期和日期信息每天只计算一次
     """
     study_year_info = get_study_year_info()
     semester_info = get_semester_info()
@@ -51,5 +50,15 @@ def format_prompt_template(template: str = PROMPT, command: str = DEFAULT_COMMAN
     return template
 
 
+def format_prompt_template(template: str = PROMPT, command: str = DEFAULT_COMMAND) -> str:
+    """
+    生成 prompt 模板，目前支持的变量有：
+    - study_year_info: 学年信息
+    - semester_info: 学期信息
+    - date: 今天的日期
+    """
+    return _format_prompt_template(template, command, date.today())
+
+
 if __name__ == "__main__":
     print(format_prompt_template())
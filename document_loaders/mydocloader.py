@@ -1,5 +1,6 @@
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
 from typing import List
+from document_loaders.ocr import ocr_pool
 import tqdm
 
 
@@ -13,11 +14,10 @@ class RapidOCRDocLoader(UnstructuredFileLoader):
             from docx import Document, ImagePart
             from PIL import Image
             from io import BytesIO
-            import numpy as np
-            from rapidocr_onnxruntime import RapidOCR
-            ocr = RapidOCR()
             doc = Document(filepath)
-            resp = ""
+            # 文本与图片按顺序放入 parts，图片位置先用其在 images 中的序号占位，全部收集后一次批量 OCR
+            parts = []
+            images = []
 
             def iter_block_items(parent):
                 from docx.document import Document
@@ -41,24 +41,22 @@ class RapidOCRDocLoader(UnstructuredFileLoader):
                     "RapidOCRDocLoader  block index: {}".format(i))
                 b_unit.refresh()
                 if isinstance(block, Paragraph):
-                    resp += block.text.strip() + "\n"
-                    images = block._element.xpath('.//pic:pic')  # 获取所有图片
-                    for image in images:
-                        for img_id in image.xpath('.//a:blip/@r:embed'):  # 获取图片id
+                    parts.append(block.text.strip() + "\n")
+                    pics = block._element.xpath('.//pic:pic')  # 获取所有图片
+                    for pic in pics:
+                        for img_id in pic.xpath('.//a:blip/@r:embed'):  # 获取图片id
                             part = doc.part.related_parts[img_id]  # 根据图片id获取对应的图片
                             if isinstance(part, ImagePart):
-                                image = Image.open(BytesIO(part._blob))
-                                result, _ = ocr(np.array(image))
-                                if result:
-                                    ocr_result = [line[1] for line in result]
-                                    resp += "\n".join(ocr_result)
+                                parts.append(len(images))
+                                images.append(Image.open(BytesIO(part._blob)))
                 elif isinstance(block, Table):
                     for row in block.rows:
                         for cell in row.cells:
                             for paragraph in cell.paragraphs:
-                                resp += paragraph.text.strip() + "\n"
+                                parts.append(paragraph.text.strip() + "\n")
                 b_unit.update(1)
-            return resp
+            texts = ocr_pool.ocr_images(images)
+            return "".join(texts[p] if isinstance(p, int) else p for p in parts)
 
         text = doc2text(self.file_path)
         from unstructured.partition.text import partition_text
@@ -1,46 +1,172 @@
-from typing import List
+from typing import Iterator, List, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from langchain.docstore.document import Document
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
-from configs import PDF_OCR_THRESHOLD
-from document_loaders.ocr import get_ocr
+from configs import PDF_OCR_THRESHOLD, PDF_PARSE_WORKERS, PDF_PAGE_RANGE_SIZE, logger
+from document_loaders.ocr import ocr_pool
+import multiprocessing
+import threading
 import tqdm
 
 
+_page_pool: ProcessPoolExecutor = None
+_page_pool_lock = threading.Lock()
+_page_pool_unusable_logged = False
+_in_parse_worker = False
+
+
+def mark_parse_worker():
+    '''
+    由解析进程池的 initializer 调用（见 PARSE_PROCESS_WORKERS）。解析进程中文件之间已经并行，不再嵌套创建页码进程池
+    '''
+    global _in_parse_worker
+    _in_parse_worker = True
+
+
+def page_pool_unavailable_reason() -> str:
+    '''
+    当前进程不能使用页码进程池的原因，可以使用时返回空字符串。
+    startup.py 以 daemon 进程运行 API 服务，multiprocessing 不允许 daemon 进程创建子进程
+    '''
+    if _in_parse_worker:
+        return "当前进程为解析进程，文件之间已经并行"
+    process = multiprocessing.current_process()
+    if process.daemon:
+        return f"当前进程 {process.name} 为 daemon 进程，不能创建子进程"
+    return ""
+
+
+def page_pool_usable() -> bool:
+    global _page_pool_unusable_logged
+    reason = page_pool_unavailable_reason()
+    if reason and not _page_pool_unusable_logged:
+        logger.info(f"{reason}，PDF_PARSE_WORKERS 不生效，PDF 在当前进程中逐页解析")
+        _page_pool_unusable_logged = True
+    return not reason
+
+
+def get_page_pool() -> ProcessPoolExecutor:
+    '''
+    按页码范围提取 PDF 内容的进程池。PyMuPDF 不支持多线程，所以用 spawn 方式启动的进程并行，进程在多个文件之间复用
+    '''
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return _page_pool
+
+
+def _discard_page_pool(pool: ProcessPoolExecutor):
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False)
+
+
+def extract_pages(filepath: str, start: int, end: int) -> List[Tuple[str, List]]:
+    '''
+    提取 [start, end) 页的文本，以及宽高超过 PDF_OCR_THRESHOLD 的图片，返回 [(text, images), ...]。
+    每次调用单独打开文件，可以在不同进程中同时处理同一个 PDF 的不同页码范围
+    '''
+    import fitz # pyMuPDF里面的fitz包，不要与pip install fitz混淆
+    import numpy as np
+
+    pages = []
+    with fitz.open(filepath) as doc:
+        for i in range(start, end):
+            page = doc[i]
+            text = page.get_text("")
+            images = []
+            for img in page.get_image_info(xrefs=True):
+                if xref := img.get("xref"):
+                    bbox = img["bbox"]
+                    # 检查图片尺寸是否超过设定的阈值
+                    if ((bbox[2] - bbox[0]) / (page.rect.width) < PDF_OCR_THRESHOLD[0]
+                        or (bbox[3] - bbox[1]) / (page.rect.height) < PDF_OCR_THRESHOLD[1]):
+                        continue
+                    pix = fitz.Pixmap(doc, xref)
+                    images.append(np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1))
+            pages.append((text, images))
+    return pages
+
+
 class RapidOCRPDFLoader(UnstructuredFileLoader):
-    def _get_elements(self) -> List:
-        def pdf2text(filepath):
-            import fitz # pyMuPDF里面的fitz包，不要与pip install fitz混淆
-            import numpy as np
-            ocr = get_ocr()
-            doc = fitz.open(filepath)
-            resp = ""
-
-            b_unit = tqdm.tqdm(total=doc.page_count, desc="RapidOCRPDFLoader context page index: 0")
-            for i, page in enumerate(doc):
+    def iter_pages(self) -> Iterator[str]:
+        '''
+        按页码顺序逐页返回文本（页面文字 + 图片 OCR 结果）。
+        页数超过 PDF_PAGE_RANGE_SIZE 时按页码范围分发到进程池中提取，每个范围的图片批量 OCR，
+        某一页及其之前的页都完成后立即返回，不必等待整个文件解析完成
+        '''
+        import fitz
+
+        filepath = str(self.file_path)
+        with fitz.open(filepath) as doc:
+            page_count = doc.page_count
+        ranges = [(start, min(start + PDF_PAGE_RANGE_SIZE, page_count))
+                  for start in range(0, page_count, PDF_PAGE_RANGE_SIZE)]
+
+        b_unit = tqdm.tqdm(total=page_count, desc="RapidOCRPDFLoader context page index: 0")
+        parallel = PDF_PARSE_WORKERS > 0 and len(ranges) > 1 and page_pool_usable()
+        for start, pages in self._extract_ranges(filepath, ranges, parallel):
+            images = [image for _, page_images in pages for image in page_images]
+            texts = iter(ocr_pool.ocr_images(images))
+            for i, (text, page_images) in enumerate(pages, start=start):
                 b_unit.set_description("RapidOCRPDFLoader context page index: {}".format(i))
-                b_unit.refresh()
-                text = page.get_text("")
-                resp += text + "\n"
-
-                img_list = page.get_image_info(xrefs=True)
-                for img in img_list:
-                    if xref := img.get("xref"):
-                        bbox = img["bbox"]
-                        # 检查图片尺寸是否超过设定的阈值
-                        if ((bbox[2] - bbox[0]) / (page.rect.width) < PDF_OCR_THRESHOLD[0]
-                            or (bbox[3] - bbox[1]) / (page.rect.height) < PDF_OCR_THRESHOLD[1]):
-                            continue
-                        pix = fitz.Pixmap(doc, xref)
-                        img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)
-                        result, _ = ocr(img_array)
-                        if result:
-                            ocr_result = [line[1] for line in result]
-                            resp += "\n".join(ocr_result)
-
-                # 更新进度
                 b_unit.update(1)
-            return resp
+                yield "".join([text, "\n", *(next(texts) for _ in page_images)])
+        b_unit.close()
 
-        text = pdf2text(self.file_path)
+    def _extract_ranges(self, filepath: str, ranges: List[Tuple[int, int]], parallel: bool) -> Iterator:
+        '''
+        按顺序返回 (start, pages)。并行时最多同时提交 2 * PDF_PARSE_WORKERS 个范围，
+        未取走的图片不会在内存中无限堆积
+        '''
+        done = 0  # 已经返回的页码范围的结束页
+        if parallel:
+            pool = get_page_pool()
+            pending = deque()
+            try:
+                for start, end in ranges:
+                    pending.append((start, end, pool.submit(extract_pages, filepath, start, end)))
+                    while len(pending) >= 2 * PDF_PARSE_WORKERS or (pending and end == ranges[-1][1]):
+                        first, last, future = pending[0]
+                        pages = future.result()
+                        pending.popleft()
+                        done = last
+                        yield first, pages
+                return
+            except BrokenProcessPool as e:
+                # 进程异常退出会导致整个进程池不可用，丢弃后由下一个文件重新创建；当前文件剩余的页改为在本进程中提取。
+                # 其它错误（如页面损坏）与进程池无关，直接抛出，由 file2text 报告文件解析失败
+                logger.warning(f"{e.__class__.__name__}: 并行解析 {filepath} 失败，改为在当前进程中解析：{e}")
+                _discard_page_pool(pool)
+            finally:
+                for *_, future in pending:
+                    future.cancel()
+        for start, end in ranges:
+            if start < done:
+                continue
+            yield start, extract_pages(filepath, start, end)
+
+    def lazy_load(self) -> Iterator[Document]:
+        '''
+        逐页返回 Document，metadata 中记录页码，可以在整个文件解析完成之前开始切分
+        '''
+        from unstructured.partition.text import partition_text
+
+        metadata = self._get_metadata()
+        for i, text in enumerate(self.iter_pages()):
+            elements = partition_text(text=text, **self.unstructured_kwargs)
+            content = "\n\n".join([str(el) for el in elements])
+            if content:
+                yield Document(page_content=content, metadata={**metadata, "page": i})
+
+    def _get_elements(self) -> List:
+        text = "".join(self.iter_pages())
         from unstructured.partition.text import partition_text
         return partition_text(text=text, **self.unstructured_kwargs)
 
@@ -1,5 +1,6 @@
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
 from typing import List
+from document_loaders.ocr import ocr_pool
 import tqdm
 
 
@@ -8,28 +9,24 @@ class RapidOCRPPTLoader(UnstructuredFileLoader):
         def ppt2text(filepath):
             from pptx import Presentation
             from PIL import Image
-            import numpy as np
             from io import BytesIO
-            from rapidocr_onnxruntime import RapidOCR
-            ocr = RapidOCR()
             prs = Presentation(filepath)
-            resp = ""
+            resp = []
+            # 每张幻灯片的文本与图片按顺序放入 parts，图片先用其在 images 中的序号占位，整张幻灯片批量 OCR
+            parts = []
+            images = []
 
             def extract_text(shape):
-                nonlocal resp
                 if shape.has_text_frame:
-                    resp += shape.text.strip() + "\n"
+                    parts.append(shape.text.strip() + "\n")
                 if shape.has_table:
                     for row in shape.table.rows:
                         for cell in row.cells:
                             for paragraph in cell.text_frame.paragraphs:
-                                resp += paragraph.text.strip() + "\n"
+                                parts.append(paragraph.text.strip() + "\n")
                 if shape.shape_type == 13:  # 13 表示图片
-                    image = Image.open(BytesIO(shape.image.blob))
-                    result, _ = ocr(np.array(image))
-                    if result:
-                        ocr_result = [line[1] for line in result]
-                        resp += "\n".join(ocr_result)
+                    parts.append(len(images))
+                    images.append(Image.open(BytesIO(shape.image.blob)))
                 elif shape.shape_type == 6:  # 6 表示组合
                     for child_shape in shape.shapes:
                         extract_text(child_shape)
@@ -45,8 +42,12 @@ class RapidOCRPPTLoader(UnstructuredFileLoader):
                                        key=lambda x: (x.top, x.left))  # 从上到下、从左到右遍历
                 for shape in sorted_shapes:
                     extract_text(shape)
+                texts = ocr_pool.ocr_images(images)
+                resp.extend(texts[p] if isinstance(p, int) else p for p in parts)
+                parts.clear()
+                images.clear()
                 b_unit.update(1)
-            return resp
+            return "".join(resp)
 
         text = ppt2text(self.file_path)
         from unstructured.partition.text import partition_text
@@ -1,4 +1,12 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from configs import OCR_ENGINE_NUM, OCR_CACHE_SIZE
+import numpy as np
+import hashlib
+import queue
+import threading
 
 
 if TYPE_CHECKING:
@@ -16,3 +24,99 @@ def get_ocr(use_cuda: bool = True) -> "RapidOCR":
         from rapidocr_onnxruntime import RapidOCR
         ocr = RapidOCR()
     return ocr
+
+
+def image_digest(image: "np.ndarray") -> Tuple[Tuple[int, ...], str, bytes]:
+    '''
+    图片像素内容的摘要（形状、类型与 blake2b），只有像素完全相同的图片（如每页重复的页眉、校徽）得到相同的值
+    '''
+    image = np.ascontiguousarray(image)
+    return image.shape, image.dtype.str, hashlib.blake2b(image.data, digest_size=16).digest()
+
+
+class OCRPool:
+    '''
+    进程内共享的 OCR 引擎池。引擎在第一次使用时创建，最多 size 个，同时进行 OCR 的图片数不超过 size。
+    识别结果按图片像素的摘要缓存，重复出现的图片只识别一次
+    '''
+    def __init__(self, size: int = 2, cache_size: int = 1024):
+        self.size = max(1, size)
+        self.cache_size = cache_size
+        self._engines = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._executor: ThreadPoolExecutor = None
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def acquire(self) -> "RapidOCR":
+        with self._lock:
+            if self._engines.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                engine = get_ocr()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            engine = self._engines.get()
+        try:
+            yield engine
+        finally:
+            self._engines.put(engine)
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            return None
+
+    def _cache_set(self, key, text: str):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def ocr_image(self, image) -> str:
+        '''
+        识别单张图片（文件路径、ndarray 或 PIL.Image），返回按行拼接的文本
+        '''
+        key = None
+        if not isinstance(image, str):
+            image = np.asarray(image)
+            if self.cache_size > 0:
+                key = image_digest(image)
+                if (text := self._cache_get(key)) is not None:
+                    return text
+        with self.acquire() as engine:
+            result, _ = engine(image)
+        text = "\n".join(line[1] for line in result) if result else ""
+        if key is not None:
+            self._cache_set(key, text)
+        return text
+
+    def ocr_images(self, images: List) -> List[str]:
+        '''
+        批量识别一页或一张幻灯片中的图片，图片分发到池中的各个引擎同时识别，结果与 images 一一对应
+        '''
+        if len(images) <= 1 or self.size == 1:
+            return [self.ocr_image(image) for image in images]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.size, thread_name_prefix="ocr")
+        return list(self._executor.map(self.ocr_image, images))
+
+
+ocr_pool = OCRPool(size=OCR_ENGINE_NUM, cache_size=OCR_CACHE_SIZE)
@@ -11,7 +11,7 @@ import argparse
 import uvicorn
 from fastapi import Body
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, JSONResponse
 from server.chat.chat import chat
 from server.chat.search_engine_chat import search_engine_chat
 from server.chat.search_engine_chat_with_site import search_engine_chat_with_site
@@ -23,6 +23,7 @@ from server.llm_api import (list_running_models, list_config_models,
                             get_model_config, list_search_engines)
 from server.utils import (BaseResponse, ListResponse, FastAPI, MakeFastAPIOffline,
                           get_server_configs, get_prompt_template)
+from server.warmup import warmup_manager
 from typing import List, Literal
 
 nltk.data.path = [NLTK_DATA_PATH] + nltk.data.path
@@ -32,6 +33,13 @@ async def document():
     return RedirectResponse(url="/docs")
 
 
+async def health():
+    '''
+    预热完成后返回 200，预热中返回 503
+    '''
+    return JSONResponse(warmup_manager.status(), status_code=200 if warmup_manager.ready else 503)
+
+
 def create_app(run_mode: str = None):
     app = FastAPI(
         title="Langchain-Chatchat API Server",
@@ -50,6 +58,11 @@ def create_app(run_mode: str = None):
             allow_headers=["*"],
         )
     mount_app_routes(app, run_mode=run_mode)
+
+    @app.on_event("startup")
+    async def start_warmup():
+        warmup_manager.start()
+
     return app
 
 
@@ -58,6 +71,9 @@ def mount_app_routes(app: FastAPI, run_mode: str = None):
             response_model=BaseResponse,
             summary="swagger 文档")(document)
 
+    app.get("/health",
+            summary="服务预热状态，预热完成前返回 503")(health)
+
     # Tag: Chat
     app.post("/chat/chat",
              tags=["Chat"],
@@ -150,8 +166,8 @@ def mount_knowledge_routes(app: FastAPI):
     from server.knowledge_base.kb_api import list_kbs, create_kb, delete_kb
     from server.knowledge_base.kb_doc_api import (list_files, upload_docs, delete_docs,
                                                 update_docs, download_doc, recreate_vector_store,
-                                                search_docs, DocumentWithVSId, update_info,
-                                                update_docs_by_id,)
+                                                search_docs, search_docs_batch, DocumentWithVSId,
+                                                update_info, update_docs_by_id,)
 
     app.post("/chat/knowledge_base_chat",
              tags=["Chat"],
@@ -200,6 +216,12 @@ def mount_knowledge_routes(app: FastAPI):
              summary="搜索知识库"
              )(search_docs)
 
+    app.post("/knowledge_base/search_docs_batch",
+             tags=["Knowledge Base Management"],
+             response_model=List[List[DocumentWithVSId]],
+             summary="批量搜索知识库"
+             )(search_docs_batch)
+
     app.post("/knowledge_base/update_docs_by_id",
              tags=["Knowledge Base Management"],
              response_model=BaseResponse,
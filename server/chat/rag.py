@@ -19,12 +19,12 @@ from typing import AsyncIterable, List, Optional
 import asyncio
 from langchain.prompts.chat import ChatPromptTemplate
 from server.chat.utils import History
-from server.knowledge_base.kb_service.base import KBServiceFactory
+from server.knowledge_base.kb_service.base import KBServiceFactory, reciprocal_rank_fusion
 import json
 import os
 from pathlib import Path
 from urllib.parse import urlencode
-from server.knowledge_base.kb_doc_api import search_docs
+from server.knowledge_base.model.kb_document_model import DocumentWithVSId
 from server.reranker.reranker import LangchainReranker
 from server.utils import embedding_device
 
@@ -153,21 +153,30 @@ async def knowledge_base_chat_with_rag(
         )
 
         queries = [query]
+        # 查询扩展与 HyDE 的 LLM 调用互不依赖，并发执行
+        llm_tasks = {}
         if with_query_expansion:
-            queries.extend(await query_expansion(query, model_name))
+            llm_tasks["expansion"] = query_expansion(query, model_name)
         if with_hyde:
-            queries.append(await hyde(query, model_name))
+            llm_tasks["hyde"] = hyde(query, model_name)
+        llm_results = dict(zip(llm_tasks.keys(), await asyncio.gather(*llm_tasks.values())))
+        queries.extend(llm_results.get("expansion", []))
+        if "hyde" in llm_results:
+            queries.append(llm_results["hyde"])
 
-        docs = []
-
-        for q in queries:
-            docs += await run_in_threadpool(
-                search_docs,
-                query=q,
-                knowledge_base_name=knowledge_base_name,
-                top_k=top_k,
-                score_threshold=score_threshold,
-            )
+        # 所有查询一次性向量化，并在已加载的向量库上并发检索
+        results = await run_in_threadpool(
+            kb.search_docs_batch,
+            queries=queries,
+            top_k=top_k,
+            score_threshold=score_threshold,
+        )
+        # 多个查询命中同一文本块时去重并做排名融合，避免重复内容占用 top_k 和 reranker 批次
+        docs = reciprocal_rank_fusion([
+            [DocumentWithVSId(**doc.dict(), score=score, id=doc.metadata.get("id"))
+             for doc, score in result]
+            for result in results
+        ])
         print("----------------- INFO START ------------------")
         print("knowledge base:", knowledge_base_name)
         print("query expansion:", with_query_expansion)
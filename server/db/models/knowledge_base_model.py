@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import Column, Integer, String, DateTime, JSON, func
 
 from server.db.base import Base
 
@@ -14,6 +14,7 @@ class KnowledgeBaseModel(Base):
     vs_type = Column(String(50), comment='向量库类型')
     embed_model = Column(String(50), comment='嵌入模型名称')
     file_count = Column(Integer, default=0, comment='文件数量')
+    index_config = Column(JSON, default={}, comment='向量索引配置（用于FAISS）')
     create_time = Column(DateTime, default=func.now(), comment='创建时间')
 
     def __repr__(self):
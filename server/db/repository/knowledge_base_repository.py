@@ -40,6 +40,20 @@ def load_kb_from_db(session, kb_name):
     return kb_name, vs_type, embed_model
 
 
+@with_session
+def get_kb_index_config(session, kb_name: str) -> dict:
+    kb = session.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.kb_name.ilike(kb_name)).first()
+    return dict(kb.index_config or {}) if kb else {}
+
+
+@with_session
+def update_kb_index_config(session, kb_name: str, index_config: dict):
+    kb = session.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.kb_name.ilike(kb_name)).first()
+    if kb:
+        kb.index_config = index_config
+    return True
+
+
 @with_session
 def delete_kb_from_db(session, kb_name):
     kb = session.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.kb_name.ilike(kb_name)).first()
@@ -58,6 +72,7 @@ def get_kb_detail(session, kb_name: str) -> dict:
             "vs_type": kb.vs_type,
             "embed_model": kb.embed_model,
             "file_count": kb.file_count,
+            "index_config": kb.index_config or {},
             "create_time": kb.create_time,
         }
     else:
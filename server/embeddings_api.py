@@ -1,14 +1,274 @@
 from langchain.docstore.document import Document
-from configs import EMBEDDING_MODEL, logger
+from configs import (EMBEDDING_MODEL, QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL,
+                     QUERY_EMBED_CACHE_PATH, CHUNK_EMBED_CACHE_PATH, CHUNK_EMBED_CACHE_MAX_BYTES, logger)
 from server.model_workers.base import ApiEmbeddingsParams
 from server.utils import BaseResponse, get_model_worker_config, list_embed_models, list_online_embed_models
 from fastapi import Body
 from fastapi.concurrency import run_in_threadpool
-from typing import Dict, List
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import atexit
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import numpy as np
 
 online_embed_models = list_online_embed_models()
 
 
+class QueryEmbeddingCache:
+    '''
+    查询向量的 LRU 缓存，键为 (embed_model, 规范化后的查询)，值为归一化后的 float32 向量。
+    超过 max_size 时淘汰最久未使用的条目，超过 ttl 秒的条目视为失效。
+    指定 path 时启动时从文件恢复，进程退出时写回文件。
+    '''
+    def __init__(self, max_size: int = 4096, ttl: float = 0, path: str = ""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(embed_model: str, query: str) -> Tuple[str, str]:
+        return embed_model, " ".join(query.split())
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def get(self, embed_model: str, query: str) -> Optional[np.ndarray]:
+        if not self.enabled:
+            return None
+        key = self.make_key(embed_model, query)
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None or self._expired(item[0]):
+                if item is not None:
+                    del self._cache[key]
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, embed_model: str, query: str, embedding: np.ndarray):
+        if not self.enabled:
+            return
+        key = self.make_key(embed_model, query)
+        embedding = np.array(embedding, dtype=np.float32)  # 复制一份，避免调用方原地修改缓存内容
+        with self._lock:
+            self._cache[key] = (time.time(), embedding)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                items = pickle.load(f)
+        except Exception as e:
+            logger.error(f"加载查询向量缓存 {self.path} 失败：{e}")
+            return
+        with self._lock:
+            for key, (created, embedding) in items:
+                if not self._expired(created):
+                    self._cache[key] = (created, embedding)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        logger.info(f"已从 {self.path} 加载 {len(self._cache)} 条查询向量缓存")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            items = [(k, v) for k, v in self._cache.items() if not self._expired(v[0])]
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(items, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"保存查询向量缓存 {self.path} 失败：{e}")
+
+
+query_embedding_cache = QueryEmbeddingCache(max_size=QUERY_EMBED_CACHE_SIZE,
+                                            ttl=QUERY_EMBED_CACHE_TTL,
+                                            path=QUERY_EMBED_CACHE_PATH)
+
+
+class ChunkEmbeddingCache:
+    '''
+    文档片段向量的持久化缓存，键为 (embed_model, 片段文本的 sha256)，值为 float32 向量，保存在 SQLite 文件中。
+    文件被更新后重新入库时，未改变的片段直接使用缓存的向量。向量总字节数超过 max_bytes 时删除最久未使用的片段，降到九成以下。
+    命中时只有 last_used 早于 touch_interval 秒前的片段才更新，重复读取同一批片段不会每次都产生写事务
+    '''
+    def __init__(self, path: str = "", max_bytes: int = 1024 ** 3, touch_interval: float = 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection = None
+        self._count = 0
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 第一次使用时才打开文件，调用前需持有 self._lock
+        if self._conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")  # 允许 webui 与 api 等多个进程同时读写
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                         "model TEXT, hash TEXT, vector BLOB, last_used REAL, PRIMARY KEY (model, hash))")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            conn.commit()
+            self._conn = conn
+            self._refresh_size()
+        return self._conn
+
+    def _refresh_size(self):
+        # length() 读取 BLOB 的长度不需要读出内容，调用前需持有 self._lock
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+
+    def get_many(self, embed_model: str, texts: List[str], chunk_size: int = 500) -> List[Optional[np.ndarray]]:
+        '''
+        返回与 texts 一一对应的向量，未缓存的为 None
+        '''
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+        keys = [self.make_key(t) for t in texts]
+        unique = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        stale = []  # last_used 早于 touch_interval 的命中，需要更新
+        try:
+            with self._lock:
+                conn = self._connect()
+                for i in range(0, len(unique), chunk_size):
+                    chunk = unique[i:i + chunk_size]
+                    marks = ",".join("?" * len(chunk))
+                    rows = conn.execute(f"SELECT hash, vector, last_used FROM embeddings "
+                                        f"WHERE model = ? AND hash IN ({marks})",
+                                        [embed_model, *chunk])
+                    for key, vector, last_used in rows:
+                        found[key] = np.frombuffer(vector, dtype=np.float32).copy()
+                        if last_used < now - self.touch_interval:
+                            stale.append(key)
+                for i in range(0, len(stale), chunk_size):
+                    chunk = stale[i:i + chunk_size]
+                    conn.execute(f"UPDATE embeddings SET last_used = ? WHERE model = ? "
+                                 f"AND hash IN ({','.join('?' * len(chunk))})",
+                                 [now, embed_model, *chunk])
+                if stale:
+                    conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"读取片段向量缓存 {self.path} 失败：{e}")
+            return [None] * len(texts)
+        result = [found.get(k) for k in keys]
+        hits = sum(1 for v in result if v is not None)
+        self.hits += hits
+        self.misses += len(result) - hits
+        return result
+
+    def set_many(self, embed_model: str, texts: List[str], embeddings: np.ndarray):
+        if not self.enabled or not len(texts):
+            return
+        now = time.time()
+        rows = [(embed_model, self.make_key(t), np.asarray(e, dtype=np.float32).tobytes(), now)
+                for t, e in zip(texts, embeddings)]
+        try:
+            with self._lock:
+                conn = self._connect()
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                added = conn.total_changes - before
+                self._count += added
+                self._bytes += added * len(rows[0][2])  # 同一模型的向量长度相同
+                if self._bytes > self.max_bytes:
+                    # 按平均长度估算需要删除的片段数（向上取整）
+                    target = int(self.max_bytes * 0.9)
+                    excess = -(-(self._bytes - target) * self._count // self._bytes)
+                    conn.execute("DELETE FROM embeddings WHERE rowid IN "
+                                 "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                    self._refresh_size()
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"写入片段向量缓存 {self.path} 失败：{e}")
+
+    def clear(self, embed_model: str = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            if embed_model is None:
+                conn.execute("DELETE FROM embeddings")
+            else:
+                conn.execute("DELETE FROM embeddings WHERE model = ?", (embed_model,))
+            conn.commit()
+            self._refresh_size()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": self._count,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+chunk_embedding_cache = ChunkEmbeddingCache(path=CHUNK_EMBED_CACHE_PATH,
+                                            max_bytes=CHUNK_EMBED_CACHE_MAX_BYTES)
+
+
 def embed_texts(
         texts: List[str],
         embed_model: str = EMBEDDING_MODEL,
@@ -84,13 +344,30 @@ def embed_documents(
 ) -> Dict:
     """
     将 List[Document] 向量化，转化为 VectorStore.add_embeddings 可以接受的参数
+    embeddings 为 C 连续的 float32 矩阵，FAISS 可直接写入索引而无需再次复制
     """
     texts = [x.page_content for x in docs]
     metadatas = [x.metadata for x in docs]
-    embeddings = embed_texts(texts=texts, embed_model=embed_model, to_query=to_query).data
+    # 查询向量由 query_embedding_cache 缓存，这里只缓存文档片段
+    cached = chunk_embedding_cache.get_many(embed_model, texts) if not to_query else [None] * len(texts)
+    missing = [i for i, v in enumerate(cached) if v is None]
+    if len(missing) == len(texts):
+        embeddings = embed_texts(texts=texts, embed_model=embed_model, to_query=to_query).data
+        if embeddings is not None and not to_query:
+            chunk_embedding_cache.set_many(embed_model, texts, embeddings)
+    else:
+        embeddings = cached
+        if missing:
+            data = embed_texts(texts=[texts[i] for i in missing], embed_model=embed_model, to_query=to_query).data
+            if data is None:
+                return None
+            chunk_embedding_cache.set_many(embed_model, [texts[i] for i in missing], data)
+            for i, vector in zip(missing, data):
+                embeddings[i] = vector
+        logger.info(f"{len(texts) - len(missing)}/{len(texts)} 个文档片段使用了缓存的向量")
     if embeddings is not None:
         return {
             "texts": texts,
-            "embeddings": embeddings,
+            "embeddings": np.ascontiguousarray(embeddings, dtype=np.float32),
             "metadatas": metadatas,
         }
@@ -0,0 +1,222 @@
+from configs import (CHUNK_SIZE, OVERLAP_SIZE, ZH_TITLE_ENHANCE,
+                     INGEST_EMBED_BATCH_SIZE, INGEST_QUEUE_SIZE, logger, log_verbose)
+from server.knowledge_base.kb_service.base import KBService
+from server.knowledge_base.kb_cache.base import search_result_cache
+from server.knowledge_base.utils import KnowledgeFile, files2docs_in_thread
+from server.db.repository.knowledge_file_repository import add_file_to_db
+from server.utils import torch_gc
+from langchain.docstore.document import Document
+from typing import Dict, Generator, List, Tuple, Union
+from pathlib import Path
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class IngestPipeline:
+    '''
+    文件入库流水线：解析切分 → 向量化 → 写入向量库，三个阶段在不同线程中同时进行，阶段之间用有界队列连接。
+    向量化按固定的 batch_size 跨文件组批，向量库只由调用方所在的线程写入，每批只加一次锁。
+    run() 在每个文件全部写入后返回 status, (kb_name, file_name, docs_count | error)，与 files2docs_in_thread 的格式一致。
+    '''
+    def __init__(
+            self,
+            kb: KBService,
+            chunk_size: int = CHUNK_SIZE,
+            chunk_overlap: int = OVERLAP_SIZE,
+            zh_title_enhance: bool = ZH_TITLE_ENHANCE,
+            batch_size: int = INGEST_EMBED_BATCH_SIZE,
+            queue_size: int = INGEST_QUEUE_SIZE,
+    ):
+        self.kb = kb
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.zh_title_enhance = zh_title_enhance
+        self.batch_size = max(1, batch_size)
+        self._parsed = queue.Queue(maxsize=queue_size)
+        self._embedded = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        # 解析或向量化线程异常退出的原因，未完成的文件以此报告失败
+        self._error: str = None
+        self._threads: List[threading.Thread] = []
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # 调用方不再读取结果（如客户端断开）时 _stop 被设置，各阶段不会永远阻塞在已满的队列上
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        # 与 _put 相同，_stop 被设置后不再等待上一阶段（其结束标记可能没有放入队列），按结束处理
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _parse(self, files: List[Union[KnowledgeFile, Tuple[str, str], Dict]]):
+        try:
+            for status, result in files2docs_in_thread(files,
+                                                       chunk_size=self.chunk_size,
+                                                       chunk_overlap=self.chunk_overlap,
+                                                       zh_title_enhance=self.zh_title_enhance):
+                if not self._put(self._parsed, (status, result)):
+                    return
+        except Exception as e:
+            logger.error(f"{e.__class__.__name__}: 解析文件时出错：{e}", exc_info=e if log_verbose else None)
+            self._error = f"解析文件时出错：{e}"
+        finally:
+            self._put(self._parsed, _DONE)
+
+    def _embed(self):
+        '''
+        将各文件的片段依次放入缓冲区，每满 batch_size 个向量化一次。
+        文件开始时先发送 ("file", kb_file, 片段数)，写入阶段据此判断文件何时完成
+        '''
+        pending: List[Tuple[str, Document]] = []
+
+        def flush():
+            batch = pending[:]
+            pending.clear()
+            docs = [doc for _, doc in batch]
+            try:
+                if self.kb.accepts_embeddings:
+                    embeddings = self.kb._docs_to_embeddings(docs)["embeddings"]
+                else:
+                    embeddings = None
+            except Exception as e:
+                logger.error(f"{e.__class__.__name__}: 向量化时出错：{e}", exc_info=e if log_verbose else None)
+                return self._put(self._embedded, ("error", sorted({f for f, _ in batch}), f"向量化时出错：{e}"))
+            return self._put(self._embedded, ("batch", batch, embeddings))
+
+        try:
+            while True:
+                item = self._get(self._parsed)
+                if item is _DONE:
+                    break
+                status, (kb_name, file_name, result) = item
+                if not status:
+                    if not self._put(self._embedded, ("error", [file_name], result)):
+                        return
+                    continue
+                kb_file = KnowledgeFile(filename=file_name, knowledge_base_name=kb_name)
+                self.kb.relative_sources(result)
+                if not self._put(self._embedded, ("file", kb_file, len(result))):
+                    return
+                for doc in result:
+                    pending.append((file_name, doc))
+                    if len(pending) >= self.batch_size and not flush():
+                        return
+            if pending and not self._stop.is_set():
+                flush()
+        except Exception as e:
+            logger.error(f"{e.__class__.__name__}: 向量化时出错：{e}", exc_info=e if log_verbose else None)
+            self._error = f"向量化时出错：{e}"
+        finally:
+            self._put(self._embedded, _DONE)
+
+    @staticmethod
+    def _file_name(file: Union[KnowledgeFile, Tuple[str, str], Dict]) -> str:
+        # 与 KnowledgeFile.filename 相同的规范化，用于核对每个文件都有结果
+        if isinstance(file, KnowledgeFile):
+            return file.filename
+        name = file.get("filename") if isinstance(file, dict) else file[0]
+        return str(Path(name).as_posix())
+
+    def run(self, files: List[Union[KnowledgeFile, Tuple[str, str], Dict]]) -> Generator:
+        outstanding = {self._file_name(file) for file in files}
+        self._threads = [threading.Thread(target=self._parse, args=(files,), name="ingest-parse", daemon=True),
+                         threading.Thread(target=self._embed, name="ingest-embed", daemon=True)]
+        for t in self._threads:
+            t.start()
+
+        # file_name -> {"kb_file", "total", "doc_infos", "failed"}
+        files_state: Dict[str, Dict] = {}
+        try:
+            for status, result in self._consume(files_state):
+                outstanding.discard(result[1])
+                yield status, result
+            # 解析或向量化线程异常退出时，只写入了部分片段的文件删除已写入的片段，没有收到结果的文件同样报告失败
+            msg = self._error or "入库流水线异常退出"
+            for file_name, state in list(files_state.items()):
+                if not state["failed"]:
+                    yield from self._fail(files_state, file_name, msg)
+                outstanding.discard(file_name)
+            for file_name in sorted(outstanding):
+                yield False, (self.kb.kb_name, file_name, msg)
+        finally:
+            self._stop.set()
+            search_result_cache.invalidate(self.kb.kb_name)
+            torch_gc()
+
+    def _consume(self, files_state: Dict[str, Dict]) -> Generator:
+        while True:
+            item = self._embedded.get()
+            if item is _DONE:
+                return
+            kind = item[0]
+            if kind == "file":
+                _, kb_file, total = item
+                if total == 0:
+                    # 与 add_doc 相同，没有解析出任何内容时报告失败，保留文件原有的片段
+                    yield False, (kb_file.kb_name, kb_file.filename, f"文件 {kb_file.filename} 中没有解析出任何内容")
+                    continue
+                # 与 update_doc 相同，先删除文件原有的片段
+                self.kb.delete_doc(kb_file, not_refresh_vs_cache=True)
+                files_state[kb_file.filename] = {"kb_file": kb_file, "total": total,
+                                                 "doc_infos": [], "failed": False}
+            elif kind == "error":
+                _, file_names, msg = item
+                for file_name in file_names:
+                    yield from self._fail(files_state, file_name, msg)
+            else:
+                _, batch, embeddings = item
+                yield from self._index(files_state, batch, embeddings)
+
+    def _fail(self, files_state: Dict[str, Dict], file_name: str, msg: str) -> Generator:
+        state = files_state.get(file_name)
+        if state is not None:
+            if state["failed"]:  # 每个文件只报告一次错误，之后的片段直接跳过
+                return
+            state["failed"] = True
+            # 删除已经写入的部分片段，文件不会以不完整的状态留在知识库中
+            try:
+                self.kb.delete_doc(state["kb_file"], not_refresh_vs_cache=True)
+            except Exception as e:
+                logger.error(f"{e.__class__.__name__}: 删除文件 {file_name} 的片段时出错：{e}")
+        yield False, (self.kb.kb_name, file_name, msg)
+
+    def _index(self, files_state: Dict[str, Dict], batch: List[Tuple[str, Document]], embeddings) -> Generator:
+        keep = [i for i, (file_name, _) in enumerate(batch)
+                if file_name in files_state and not files_state[file_name]["failed"]]
+        if not keep:
+            return
+        docs = [batch[i][1] for i in keep]
+        if embeddings is not None:
+            embeddings = embeddings[keep]
+        try:
+            doc_infos = self.kb.do_add_embeddings(docs, embeddings, not_refresh_vs_cache=True)
+        except Exception as e:
+            logger.error(f"{e.__class__.__name__}: 写入向量库时出错：{e}", exc_info=e if log_verbose else None)
+            for file_name in dict.fromkeys(batch[i][0] for i in keep):
+                yield from self._fail(files_state, file_name, f"写入向量库时出错：{e}")
+            return
+
+        for i, doc_info in zip(keep, doc_infos):
+            file_name = batch[i][0]
+            state = files_state[file_name]
+            state["doc_infos"].append(doc_info)
+            if len(state["doc_infos"]) == state["total"]:
+                add_file_to_db(state["kb_file"],
+                               custom_docs=False,
+                               docs_count=state["total"],
+                               doc_infos=state["doc_infos"])
+                del files_state[file_name]
+                yield True, (self.kb.kb_name, file_name, state["total"])
@@ -15,6 +15,9 @@ def list_kbs():
 def create_kb(knowledge_base_name: str = Body(..., examples=["samples"]),
               vector_store_type: str = Body("faiss"),
               embed_model: str = Body(EMBEDDING_MODEL),
+              index_config: dict = Body({}, description="向量索引配置（用于FAISS），如 {\"type\": \"hnsw\", \"ef_search\": 128}，"
+                                                        "为空时使用 FAISS_INDEX_TYPE",
+                                        examples=[{"type": "ivf_flat", "nprobe": 32}]),
               ) -> BaseResponse:
     # Create selected knowledge base
     if not validate_kb_name(knowledge_base_name):
@@ -29,6 +32,9 @@ def create_kb(knowledge_base_name: str = Body(..., examples=["samples"]),
     kb = KBServiceFactory.get_service(knowledge_base_name, vector_store_type, embed_model)
     try:
         kb.create_kb()
+        if index_config:
+            kb.update_index_config(index_config)
+            kb.build_index()
     except Exception as e:
         msg = f"创建知识库出错： {e}"
         logger.error(f'{e.__class__.__name__}: {msg}',
@@ -1,12 +1,104 @@
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.faiss import FAISS
 import threading
-from configs import (EMBEDDING_MODEL, CHUNK_SIZE,
+from configs import (EMBEDDING_MODEL, CHUNK_SIZE, RERANKER_MAX_LENGTH,
+                     SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL,
                      logger, log_verbose)
 from server.utils import embedding_device, get_model_path, list_online_embed_models
 from contextlib import contextmanager
 from collections import OrderedDict
-from typing import List, Any, Union, Tuple
+from typing import List, Any, Union, Tuple, Dict, Optional
+import time
+
+
+class RWLock:
+    '''
+    可重入的读写锁：共享模式可以有多个持有者，独占模式只有一个。
+    有线程在等待独占锁时，新的共享请求会排在它之后（写优先），避免写操作饿死。
+    持有独占锁的线程可以再次获取共享或独占锁；持有共享锁的线程不能升级为独占锁。
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers: Dict[int, int] = {}  # 线程 id -> 重入次数
+        self._writer: Optional[int] = None
+        self._writer_count = 0
+        self._waiting_writers = 0
+        # 竞争统计
+        self._shared_acquires = 0
+        self._exclusive_acquires = 0
+        self._shared_waits = 0
+        self._exclusive_waits = 0
+        self._shared_wait_time = 0.0
+        self._exclusive_wait_time = 0.0
+
+    def acquire_shared(self):
+        me = threading.get_ident()
+        with self._cond:
+            self._shared_acquires += 1
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            if self._writer is not None or self._waiting_writers:
+                self._shared_waits += 1
+                start = time.perf_counter()
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._shared_wait_time += time.perf_counter() - start
+            self._readers[me] = 1
+
+    def release_shared(self):
+        me = threading.get_ident()
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        me = threading.get_ident()
+        with self._cond:
+            self._exclusive_acquires += 1
+            if self._writer == me:
+                self._writer_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("cannot upgrade a shared lock to an exclusive lock")
+            if self._writer is not None or self._readers:
+                self._exclusive_waits += 1
+                start = time.perf_counter()
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._exclusive_wait_time += time.perf_counter() - start
+            self._writer = me
+            self._writer_count = 1
+
+    def release_exclusive(self):
+        with self._cond:
+            self._writer_count -= 1
+            if self._writer_count == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "readers": len(self._readers),
+                "writer": self._writer is not None,
+                "waiting_writers": self._waiting_writers,
+                "shared_acquires": self._shared_acquires,
+                "exclusive_acquires": self._exclusive_acquires,
+                "shared_waits": self._shared_waits,
+                "exclusive_waits": self._exclusive_waits,
+                "shared_wait_time": self._shared_wait_time,
+                "exclusive_wait_time": self._exclusive_wait_time,
+            }
 
 
 class ThreadSafeObject:
@@ -14,7 +106,7 @@ class ThreadSafeObject:
         self._obj = obj
         self._key = key
         self._pool = pool
-        self._lock = threading.RLock()
+        self._lock = RWLock()
         self._loaded = threading.Event()
 
     def __repr__(self) -> str:
@@ -26,10 +118,17 @@ class ThreadSafeObject:
         return self._key
 
     @contextmanager
-    def acquire(self, owner: str = "", msg: str = "") -> FAISS:
+    def acquire(self, owner: str = "", msg: str = "", shared: bool = False) -> FAISS:
+        '''
+        shared=True 时以共享模式加锁，用于检索等只读操作，多个线程可以同时持有；
+        默认以独占模式加锁，用于修改对象的操作。
+        '''
         owner = owner or f"thread {threading.get_native_id()}"
+        if shared:
+            self._lock.acquire_shared()
+        else:
+            self._lock.acquire_exclusive()
         try:
-            self._lock.acquire()
             if self._pool is not None:
                 self._pool._cache.move_to_end(self.key)
             if log_verbose:
@@ -38,7 +137,19 @@ class ThreadSafeObject:
         finally:
             if log_verbose:
                 logger.info(f"{owner} 结束操作：{self.key}。{msg}")
-            self._lock.release()
+            if shared:
+                self._lock.release_shared()
+            else:
+                self._lock.release_exclusive()
+
+    def lock_stats(self) -> Dict:
+        return self._lock.stats()
+
+    def size_bytes(self) -> int:
+        '''
+        对象占用内存的估计值，用于 CachePool 的内存预算。子类按需实现
+        '''
+        return 0
 
     def start_loading(self):
         self._loaded.clear()
@@ -59,18 +170,91 @@ class ThreadSafeObject:
 
 
 class CachePool:
-    def __init__(self, cache_num: int = -1):
+    '''
+    cache_num: 最多缓存的对象数量，<= 0 表示不限
+    max_bytes: 已加载对象 size_bytes() 之和的上限，<= 0 表示不限
+    policy: 超出限制时的淘汰策略，"lru" 淘汰最久未使用的对象，"lfu" 淘汰使用次数最少的对象
+    pin() 的对象不会被淘汰
+    '''
+    def __init__(self, cache_num: int = -1, max_bytes: int = 0, policy: str = "lru"):
         self._cache_num = cache_num
+        self._max_bytes = max_bytes
+        self._policy = policy
         self._cache = OrderedDict()
+        self._pinned = set()
+        self._uses: Dict[Any, int] = {}
         self.atomic = threading.RLock()
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._loads = 0
+        self._load_time = 0.0
 
     def keys(self) -> List[str]:
         return list(self._cache.keys())
 
+    def size_bytes(self) -> int:
+        return sum(v.size_bytes() for v in list(self._cache.values())
+                   if isinstance(v, ThreadSafeObject) and v._loaded.is_set())
+
+    def _over_budget(self) -> bool:
+        if isinstance(self._cache_num, int) and self._cache_num > 0 and len(self._cache) > self._cache_num:
+            return True
+        return self._max_bytes > 0 and self.size_bytes() > self._max_bytes
+
     def _check_count(self):
-        if isinstance(self._cache_num, int) and self._cache_num > 0:
-            while len(self._cache) > self._cache_num:
-                self._cache.popitem(last=False)
+        '''
+        按数量和内存预算淘汰对象。最近放入的对象（通常正在加载）和固定的对象不会被淘汰
+        '''
+        with self.atomic:
+            while self._over_budget():
+                candidates = [k for k in list(self._cache)[:-1] if k not in self._pinned]
+                if not candidates:
+                    break
+                if self._policy == "lfu":
+                    # min 对相同次数取第一个，即其中最久未使用的
+                    key = min(candidates, key=lambda k: self._uses.get(k, 0))
+                else:
+                    key = candidates[0]
+                self._cache.pop(key, None)
+                self._uses.pop(key, None)
+                self._evictions += 1
+                logger.info(f"缓存已满，释放：{key}")
+
+    def pin(self, key: Union[str, Tuple]):
+        self._pinned.add(key)
+
+    def unpin(self, key: Union[str, Tuple]):
+        self._pinned.discard(key)
+
+    def record_lookup(self, key: Union[str, Tuple], hit: bool):
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+        self._uses[key] = self._uses.get(key, 0) + 1
+
+    def record_load(self, seconds: float):
+        self._loads += 1
+        self._load_time += seconds
+
+    def stats(self) -> Dict:
+        total = self._hits + self._misses
+        return {
+            "size": len(self._cache),
+            "cache_num": self._cache_num,
+            "bytes": self.size_bytes(),
+            "max_bytes": self._max_bytes,
+            "policy": self._policy,
+            "pinned": [str(k) for k in self._pinned],
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+            "evictions": self._evictions,
+            "loads": self._loads,
+            "load_time": self._load_time,
+        }
 
     def get(self, key: str) -> ThreadSafeObject:
         if cache := self._cache.get(key):
@@ -86,15 +270,16 @@ class CachePool:
         if key is None:
             return self._cache.popitem(last=False)
         else:
+            self._uses.pop(key, None)
             return self._cache.pop(key, None)
 
-    def acquire(self, key: Union[str, Tuple], owner: str = "", msg: str = ""):
+    def acquire(self, key: Union[str, Tuple], owner: str = "", msg: str = "", shared: bool = False):
         cache = self.get(key)
         if cache is None:
             raise RuntimeError(f"请求的资源 {key} 不存在")
         elif isinstance(cache, ThreadSafeObject):
             self._cache.move_to_end(key)
-            return cache.acquire(owner=owner, msg=msg)
+            return cache.acquire(owner=owner, msg=msg, shared=shared)
         else:
             return cache
 
@@ -159,4 +344,103 @@ class EmbeddingsPool(CachePool):
         return self.get(key).obj
 
 
+class RerankerPool(CachePool):
+    def load_reranker(
+            self,
+            model_name_or_path: str,
+            device: str = None,
+            max_length: int = RERANKER_MAX_LENGTH,
+    ) -> Any:
+        '''
+        加载 CrossEncoder 模型，同一 (模型路径, 设备, max_length) 在进程内只加载一次。
+        '''
+        self.atomic.acquire()
+        device = embedding_device(device)
+        key = (model_name_or_path, device, max_length)
+        if not self.get(key):
+            item = ThreadSafeObject(key, pool=self)
+            self.set(key, item)
+            with item.acquire(msg="初始化"):
+                self.atomic.release()
+                from sentence_transformers import CrossEncoder
+                item.obj = CrossEncoder(model_name=model_name_or_path,
+                                        max_length=max_length,
+                                        device=device)
+                item.finish_loading()
+        else:
+            self.atomic.release()
+        return self.get(key).obj
+
+
+class SearchResultCache:
+    '''
+    知识库检索结果缓存，键为 (kb_name, embed_model, 知识库版本, 查询, top_k, score_threshold)。
+    知识库每次被修改时调用 invalidate 使版本号加一，并删除该知识库的全部缓存条目。
+    '''
+    def __init__(self, max_size: int = 2048, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple, Tuple[float, List]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def version(self, kb_name: str) -> int:
+        return self._versions.get(kb_name, 0)
+
+    def make_key(self, kb_name: str, embed_model: str, query: str, top_k: int, score_threshold: float) -> Tuple:
+        return (kb_name, embed_model, self.version(kb_name), " ".join(query.split()), top_k, score_threshold)
+
+    def get(self, key: Tuple) -> Optional[List]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None or (self.ttl and time.time() - item[0] > self.ttl):
+                if item is not None:
+                    del self._cache[key]
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return list(item[1])
+
+    def set(self, key: Tuple, docs: List):
+        if not self.enabled:
+            return
+        with self._lock:
+            if key[2] != self.version(key[0]):  # 检索期间知识库已被修改，结果不再可信
+                return
+            self._cache[key] = (time.time(), list(docs))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, kb_name: str):
+        with self._lock:
+            self._versions[kb_name] = self.version(kb_name) + 1
+            for key in [k for k in self._cache if k[0] == kb_name]:
+                del self._cache[key]
+        if log_verbose:
+            logger.info(f"知识库 {kb_name} 已修改，检索结果缓存失效")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
 embeddings_pool = EmbeddingsPool(cache_num=1)
+reranker_pool = RerankerPool(cache_num=1)
+search_result_cache = SearchResultCache(max_size=SEARCH_RESULT_CACHE_SIZE, ttl=SEARCH_RESULT_CACHE_TTL)
@@ -1,15 +1,82 @@
-from configs import CACHED_VS_NUM, CACHED_MEMO_VS_NUM
+from configs import (CACHED_VS_NUM, CACHED_MEMO_VS_NUM, FAISS_SAVE_DELAY, FAISS_SAVE_MAX_DELAY,
+                     FAISS_DOCSTORE_FORMAT, FAISS_MMAP_INDEX,
+                     CACHED_VS_MAX_BYTES, CACHED_VS_POLICY, CACHED_VS_PINNED, FAISS_HNSW_REBUILD_RATIO)
 from server.knowledge_base.kb_cache.base import *
+from server.knowledge_base.kb_cache.sqlite_docstore import SqliteDocstore
+from server.knowledge_base.kb_cache import faiss_index
+from server.db.repository.knowledge_base_repository import get_kb_index_config
 from server.knowledge_base.kb_service.base import EmbeddingsFunAdapter
 from server.utils import load_local_embeddings
 from server.knowledge_base.utils import get_vs_path
 from langchain.vectorstores.faiss import FAISS
+from langchain.vectorstores.utils import DistanceStrategy
 from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
+import numpy as np
+import operator
+import atexit
+import itertools
 import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Set
 from langchain.schema import Document
 
 
+# 向量库目录中指向当前版本目录的文件，见 ThreadSafeFaiss.save
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+# 旧版本直接保存在向量库目录下的文件
+LEGACY_FILES = ("index.faiss", "index.pkl", SqliteDocstore.filename)
+
+
+def current_vs_dir(vs_path: str) -> str:
+    '''
+    返回向量库当前版本所在的目录。没有 CURRENT 文件时为旧格式，文件直接保存在 vs_path 下
+    '''
+    try:
+        with open(os.path.join(vs_path, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return vs_path
+    version_path = os.path.join(vs_path, name)
+    return version_path if name and os.path.isdir(version_path) else vs_path
+
+
+def _fsync_files(path: str):
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as f:
+            os.fsync(f.fileno())
+
+
+def _atomic_write(path: str, content: str):
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def verify_vector_store(name, vs: FAISS):
+    '''
+    检查索引中的向量与 docstore 中的文档一一对应。HNSW 中已删除的向量只做标记，向量数可以多于文档数
+    '''
+    count = len(vs.docstore._dict)
+    mapped = len(vs.index_to_docstore_id)
+    ntotal = vs.index.ntotal
+    if mapped != count or not (ntotal == mapped or (faiss_index.is_hnsw(vs.index) and ntotal > mapped)):
+        raise RuntimeError(f"向量库 {name} 的索引与 docstore 不一致：索引中有 {ntotal} 个向量，"
+                           f"docstore 中有 {count} 个文档，位置映射有 {mapped} 项，请重建向量库")
+
+
 # patch FAISS to include doc id in Document.metadata
 def _new_ds_search(self, search: str) -> Union[str, Document]:
     if search not in self._dict:
@@ -23,6 +90,24 @@ InMemoryDocstore.search = _new_ds_search
 
 
 class ThreadSafeFaiss(ThreadSafeObject):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 二级索引：小写的 metadata["source"] -> 向量 id 集合，用于按文件删除和查询
+        self._source_index: Dict[str, Set[str]] = None
+        self._source_index_owner: int = None
+        self._source_index_size = 0
+        # docstore id -> 向量在索引中的 label（index_to_docstore_id 的反向映射），以及下一个可用的 label
+        self._label_index: Dict[str, int] = None
+        self._label_index_owner: int = None
+        self._next_label = 0
+        self._save_lock = threading.Lock()
+        # 以 mmap 只读方式打开的索引文件路径，第一次修改前需要完整读入内存
+        self._mmap_path: str = None
+        # (向量库对象 id, 文档数量, 估计的字节数)
+        self._size_cache: Tuple[int, int, int] = None
+        # 知识库的索引配置，见 faiss_index.normalize_index_config
+        self.index_config: Dict = None
+
     def __repr__(self) -> str:
         cls = type(self).__name__
         return f"<{cls}: key: {self.key}, obj: {self._obj}, docs_count: {self.docs_count()}>"
@@ -30,38 +115,447 @@ class ThreadSafeFaiss(ThreadSafeObject):
     def docs_count(self) -> int:
         return len(self._obj.docstore._dict)
 
+    def size_bytes(self) -> int:
+        '''
+        估计索引与 docstore 占用的内存。文档数量不变时直接返回上次的结果；
+        docstore 大小按最多 1000 个文档的平均长度估算，不会遍历全部文档。不加锁，结果只用于缓存预算
+        '''
+        vs = self._obj
+        if vs is None:
+            return 0
+        count = len(vs.docstore._dict)
+        if self._size_cache is not None and self._size_cache[:2] == (id(vs), count):
+            return self._size_cache[2]
+
+        index = vs.index
+        if faiss_index.invlists_on_disk(index):
+            index_bytes = 0  # mmap 打开的 IVF 倒排表在磁盘上，按需读入
+        else:
+            code_size = getattr(faiss_index._inner_index(index), "code_size", index.d * 4)
+            index_bytes = index.ntotal * code_size
+        if isinstance(vs.docstore, SqliteDocstore):
+            docs = list(vs.docstore._dict._added.values())  # 文件中的文档不占用内存
+        else:
+            docs = list(itertools.islice(vs.docstore._dict.values(), 1000))
+        if docs:
+            # 中文按每字符 4 字节估计，另加 Document 对象与 metadata 的开销
+            avg = sum(len(d.page_content) * 4 + 512 for d in docs) / len(docs)
+            docstore_bytes = int(avg * (len(docs) if isinstance(vs.docstore, SqliteDocstore) else count))
+        else:
+            docstore_bytes = 0
+        # index_to_docstore_id 与来源索引中每个 id 约 200 字节
+        size = index_bytes + docstore_bytes + count * 200
+        self._size_cache = (id(vs), count, size)
+        return size
+
     def save(self, path: str, create_path: bool = True):
-        with self.acquire():
+        '''
+        每次保存写入 path 下新的版本目录，全部文件写完并落盘后再原子地替换 CURRENT 指向新目录，最后删除旧版本。
+        保存中途出错或进程退出时 CURRENT 仍指向完整的旧版本，index.faiss 与 docstore 不会来自不同的版本。
+        保存只读取向量库，因此使用共享锁，保存期间检索不受影响；同一向量库的多次保存依次进行
+        '''
+        with self._save_lock, self.acquire(shared=True):
             if not os.path.isdir(path) and create_path:
                 os.makedirs(path)
-            ret = self._obj.save_local(path)
+            version = f"{VERSION_PREFIX}{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+            version_path = os.path.join(path, version)
+            try:
+                ret = self._save_to(version_path)
+                _fsync_files(version_path)
+                _atomic_write(os.path.join(path, CURRENT_FILE), version)
+            except BaseException:
+                shutil.rmtree(version_path, ignore_errors=True)
+                raise
+
+            in_use = None
+            docstore = self._obj.docstore
+            if isinstance(docstore, SqliteDocstore):
+                db_path = os.path.join(version_path, SqliteDocstore.filename)
+                if os.path.isfile(db_path):
+                    docstore.reopen(db_path)
+                else:
+                    in_use = os.path.dirname(os.path.abspath(docstore.path))  # 保存为 pickle 格式时仍在读取旧文件
+            if self._mmap_path is not None:
+                # 未修改过的 mmap 索引与新保存的文件内容相同，之后从新文件完整读入
+                self._mmap_path = os.path.join(version_path, "index.faiss")
+            self._remove_old_versions(path, keep=version, in_use=in_use)
             logger.info(f"已将向量库 {self.key} 保存到磁盘")
         return ret
 
+    def _save_to(self, path: str):
+        '''
+        FAISS_DOCSTORE_FORMAT 为 "sqlite" 时保存为 index.faiss + docstore.sqlite，
+        否则使用 FAISS.save_local 的 index.faiss + index.pkl
+        '''
+        import faiss
+        vs = self._obj
+        if FAISS_DOCSTORE_FORMAT == "sqlite":
+            os.makedirs(path, exist_ok=True)
+            faiss.write_index(vs.index, os.path.join(path, "index.faiss"))
+            SqliteDocstore.dump(vs.docstore, vs.index_to_docstore_id, os.path.join(path, SqliteDocstore.filename))
+        elif isinstance(vs.docstore, SqliteDocstore):
+            # 与 FAISS.save_local 相同的格式，SqliteDocstore 需要先转换为 InMemoryDocstore
+            os.makedirs(path, exist_ok=True)
+            faiss.write_index(vs.index, os.path.join(path, "index.faiss"))
+            with open(os.path.join(path, "index.pkl"), "wb") as f:
+                pickle.dump((InMemoryDocstore(dict(vs.docstore._dict.items())), vs.index_to_docstore_id), f)
+        else:
+            return vs.save_local(path)
+
+    @staticmethod
+    def _remove_old_versions(path: str, keep: str, in_use: str = None):
+        '''
+        删除 keep 以外的版本目录、保存失败留下的临时目录，以及旧格式直接保存在 path 下的文件。
+        in_use 为仍被 docstore 读取的目录，暂不删除
+        '''
+        in_use = in_use and os.path.abspath(in_use)
+        for name in os.listdir(path):
+            full = os.path.join(path, name)
+            if name == keep or os.path.abspath(full) == in_use:
+                continue
+            if os.path.isdir(full) and (name.startswith(VERSION_PREFIX) or name.startswith(".tmp-")):
+                shutil.rmtree(full, ignore_errors=True)
+            elif name in LEGACY_FILES and os.path.abspath(path) != in_use:
+                os.remove(full)
+
+    @contextmanager
+    def acquire(self, owner: str = "", msg: str = "", shared: bool = False) -> FAISS:
+        with super().acquire(owner=owner, msg=msg, shared=shared) as vs:
+            if not shared and vs is not None:
+                self._ensure_writable(vs)
+            yield vs
+
+    def _ensure_writable(self, vs: FAISS):
+        '''
+        mmap 打开的索引是只读的，修改前从文件完整读入。未修改过的 mmap 索引与文件内容一致。调用前需持有独占锁。
+        '''
+        if self._mmap_path is not None:
+            import faiss
+            vs.index = faiss.read_index(self._mmap_path)
+            faiss_index.apply_search_params(vs.index, self.index_config)
+            self._mmap_path = None
+            self._size_cache = None
+
+    def build_index(self, index_config: Dict = None):
+        '''
+        按 index_config（默认为知识库的配置）用向量库中的全部向量重新构建索引，IVF 类索引在此时训练。
+        各向量的 label 不变，index_to_docstore_id 无需修改。之后的增量添加直接写入训练好的索引，不再重新训练
+        '''
+        with self.acquire(msg="构建索引") as vs:
+            config = index_config if index_config is not None else self.index_config
+            labels = list(vs.index_to_docstore_id)
+            vectors = faiss_index.reconstruct_labels(vs.index, labels)
+            vs.index = faiss_index.build_index(vs.index.d, config, vectors, labels)
+            self.index_config = config
+            self._size_cache = None
+
+    def save_later(self, path: str):
+        '''
+        标记向量库有未保存的修改，由 faiss_persister 在后台合并保存
+        '''
+        faiss_persister.mark_dirty(self, path)
+
+    @staticmethod
+    def _source_key(doc: Document) -> str:
+        return str(doc.metadata.get("source", "")).lower()
+
+    def _ensure_source_index(self, vs: FAISS) -> Dict[str, Set[str]]:
+        '''
+        索引在第一次使用时从 docstore 构建。向量库被替换，或者绕过 ThreadSafeFaiss
+        直接修改过 docstore（文档数量对不上）时重新构建。调用前需持有锁。
+        '''
+        if (self._source_index is None
+                or self._source_index_owner != id(vs)
+                or self._source_index_size != len(vs.docstore._dict)):
+            index = {}
+            if isinstance(vs.docstore, SqliteDocstore):
+                for id_, source in vs.docstore._dict.source_items():
+                    index.setdefault(source, set()).add(id_)
+            else:
+                for id_, doc in vs.docstore._dict.items():
+                    index.setdefault(self._source_key(doc), set()).add(id_)
+            self._source_index = index
+            self._source_index_owner = id(vs)
+            self._source_index_size = len(vs.docstore._dict)
+        return self._source_index
+
+    def _ensure_label_index(self, vs: FAISS) -> Dict[str, int]:
+        '''
+        与来源索引相同，第一次使用时从 index_to_docstore_id 构建，向量库被替换或数量对不上时重新构建。调用前需持有锁。
+        '''
+        if (self._label_index is None
+                or self._label_index_owner != id(vs)
+                or len(self._label_index) != len(vs.index_to_docstore_id)):
+            self._label_index = {id_: label for label, id_ in vs.index_to_docstore_id.items()}
+            self._next_label = faiss_index.next_label(vs.index, vs.index_to_docstore_id)
+            self._label_index_owner = id(vs)
+        return self._label_index
+
+    def ids_by_source(self, source: str) -> List[str]:
+        '''
+        返回 metadata["source"] 与 source 相同（忽略大小写）的所有向量 id
+        '''
+        with self.acquire(shared=True) as vs:
+            return list(self._ensure_source_index(vs).get(str(source).lower(), ()))
+
+    def delete(self, ids: List[str]) -> List[str]:
+        '''
+        删除指定 id 的向量，返回实际删除的 id。
+        按 label 删除，其余向量的 label 与 index_to_docstore_id 不变，Python 部分的开销只与删除的数量有关。
+        按位置保存的索引（FAISS.delete 会重排全部位置）在第一次删除时转换为按 label 保存
+        '''
+        with self.acquire() as vs:
+            source_index = self._ensure_source_index(vs)
+            label_index = self._ensure_label_index(vs)
+            docs = {id_: vs.docstore._dict[id_] for id_ in ids if id_ in vs.docstore._dict}
+            if not docs:
+                return []
+            labels = [label_index[id_] for id_ in docs if id_ in label_index]
+            if not faiss_index.is_id_mapped(vs.index):
+                vs.index = faiss_index.to_id_mapped(vs.index)
+                faiss_index.apply_search_params(vs.index, self.index_config)
+            faiss_index.remove_labels(vs.index, labels)
+            vs.docstore.delete(list(docs))
+            for label in labels:
+                del vs.index_to_docstore_id[label]
+            self._compact_if_needed(vs)
+            for id_ in docs:
+                label_index.pop(id_, None)
+
+            for id_, doc in docs.items():
+                key = self._source_key(doc)
+                if key in source_index:
+                    source_index[key].discard(id_)
+                    if not source_index[key]:
+                        del source_index[key]
+            self._source_index_size = len(vs.docstore._dict)
+        return list(docs)
+
+    def _compact_if_needed(self, vs: FAISS):
+        '''
+        HNSW 中被删除的向量只是标记，占比超过 FAISS_HNSW_REBUILD_RATIO 时重建一次图。调用前需持有独占锁
+        '''
+        if not faiss_index.is_hnsw(vs.index):
+            return
+        dead = vs.index.ntotal - len(vs.index_to_docstore_id)
+        if dead > 0 and dead >= FAISS_HNSW_REBUILD_RATIO * vs.index.ntotal:
+            logger.info(f"向量库 {self.key} 中已删除的向量 {dead}/{vs.index.ntotal}，重建 HNSW 索引")
+            vs.index = faiss_index.compact(vs.index, list(vs.index_to_docstore_id))
+            faiss_index.apply_search_params(vs.index, self.index_config)
+            self._size_cache = None
+
+    def _search_live(self, vs: FAISS, vectors: np.ndarray, k: int) -> List[List[Tuple[float, int]]]:
+        '''
+        返回每个向量最多 k 个 (score, label)，跳过 HNSW 中已标记删除的向量。
+        有已删除的向量时先多取一倍，结果不足 k 个再加倍重试。调用前需持有锁
+        '''
+        ntotal = vs.index.ntotal
+        dead = ntotal - len(vs.index_to_docstore_id)
+        fetch = k if dead <= 0 else min(2 * k, ntotal)
+        while True:
+            scores, labels = vs.index.search(vectors, fetch)
+            rows = [[(score, i) for score, i in zip(row_scores, row_labels)
+                     if i != -1 and i in vs.index_to_docstore_id][:k]  # -1：向量库中文档数量不足 k 个
+                    for row_scores, row_labels in zip(scores, labels)]
+            if dead <= 0 or fetch >= ntotal or all(len(row) >= k for row in rows):
+                return rows
+            fetch = min(2 * fetch, ntotal)
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: np.ndarray,
+        metadatas: List[dict] = None,
+        ids: List[str] = None,
+    ) -> List[str]:
+        '''
+        将 float32 向量矩阵直接写入 FAISS 索引并原地归一化，
+        避免 FAISS.add_embeddings 中 list 与 ndarray 之间的反复转换。
+        '''
+        import faiss
+        if len(texts) == 0:
+            return []
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if len(ids) != len(set(ids)):
+            raise ValueError("Duplicate ids found in the ids list.")
+        docs = {id_: Document(page_content=text, metadata=metadata)
+                for id_, text, metadata in zip(ids, texts, metadatas)}
+        with self.acquire() as vs:
+            source_index = self._ensure_source_index(vs)
+            label_index = self._ensure_label_index(vs)
+            if vs._normalize_L2:
+                faiss.normalize_L2(vectors)
+            labels = range(self._next_label, self._next_label + len(ids))
+            faiss_index.add_vectors(vs.index, vectors, labels)
+            vs.docstore.add(docs)
+            vs.index_to_docstore_id.update(zip(labels, ids))
+            label_index.update(zip(ids, labels))
+            self._next_label += len(ids)
+
+            for id_, doc in docs.items():
+                source_index.setdefault(self._source_key(doc), set()).add(id_)
+            self._source_index_size = len(vs.docstore._dict)
+        return ids
+
+    def search_batch(
+        self,
+        embeddings: List[List[float]],
+        k: int,
+        score_threshold: float = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        '''
+        使用 FAISS 原生的多行 index.search 一次检索多个向量，结果与 embeddings 一一对应。
+        打分与过滤规则与 FAISS.similarity_search_with_score_by_vector 一致，并跳过 HNSW 中已标记删除的向量。
+        '''
+        import faiss
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        results = []
+        with self.acquire(shared=True) as vs:
+            if vs._normalize_L2:
+                faiss.normalize_L2(vectors)
+            cmp = (operator.ge
+                   if vs.distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+                   else operator.le)
+            for row in self._search_live(vs, vectors, k):
+                docs = []
+                for score, i in row:
+                    _id = vs.index_to_docstore_id[i]
+                    doc = vs.docstore.search(_id)
+                    if not isinstance(doc, Document):
+                        raise ValueError(f"Could not find document for id {_id}, got {doc}")
+                    if score_threshold is None or cmp(score, score_threshold):
+                        docs.append((doc, score))
+                results.append(docs)
+        return results
+
     def clear(self):
         ret = []
         with self.acquire():
             ids = list(self._obj.docstore._dict.keys())
             if ids:
-                ret = self._obj.delete(ids)
+                ret = self.delete(ids)
                 assert len(self._obj.docstore._dict) == 0
+            self._source_index = None
+            self._label_index = None
             logger.info(f"已将向量库 {self.key} 清空")
         return ret
 
 
+class FaissPersister:
+    '''
+    向量库的延迟保存：修改后只标记为 dirty，后台线程在 delay 秒内没有新的修改时才写盘，
+    连续修改最多推迟 max_delay 秒。这样多次修改只需保存一次，修改本身不再随向量库大小变慢。
+    进程退出时保存全部未写盘的修改。delay <= 0 时退化为每次修改立即保存。
+    '''
+    def __init__(self, delay: float = 5, max_delay: float = 60):
+        self.delay = delay
+        self.max_delay = max_delay
+        # key -> [ThreadSafeFaiss, path, 第一次标记时间, 最后一次标记时间]
+        self._dirty: Dict[Any, list] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread = None
+        atexit.register(self.flush)
+
+    def mark_dirty(self, item: "ThreadSafeFaiss", path: str):
+        if self.delay <= 0:
+            item.save(path)
+            return
+        now = time.time()
+        with self._cond:
+            if item.key in self._dirty:
+                entry = self._dirty[item.key]
+                entry[0], entry[1], entry[3] = item, path, now
+            else:
+                self._dirty[item.key] = [item, path, now, now]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="faiss-persister", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def discard(self, key):
+        '''
+        放弃 key 对应的未保存修改，用于向量库被清空或删除时
+        '''
+        with self._cond:
+            self._dirty.pop(key, None)
+
+    def _due(self, entry: list, now: float) -> bool:
+        return now - entry[3] >= self.delay or now - entry[2] >= self.max_delay
+
+    def _save(self, entry: list):
+        item, path = entry[0], entry[1]
+        try:
+            item.save(path)
+        except Exception as e:
+            logger.error(f"保存向量库 {item.key} 失败：{e}")
+
+    def flush(self, key=None):
+        '''
+        立即保存 key（为 None 时为全部）对应的未保存修改
+        '''
+        with self._cond:
+            if key is None:
+                entries = list(self._dirty.values())
+                self._dirty.clear()
+            else:
+                entry = self._dirty.pop(key, None)
+                entries = [entry] if entry else []
+        for entry in entries:
+            self._save(entry)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                due = [k for k, v in self._dirty.items() if self._due(v, now)]
+                entries = [self._dirty.pop(k) for k in due]
+                if not entries:
+                    timeout = min([max(min(v[3] + self.delay, v[2] + self.max_delay) - now, 0)
+                                   for v in self._dirty.values()] or [None])
+                    self._cond.wait(timeout)
+                    continue
+            for entry in entries:
+                self._save(entry)
+
+
+faiss_persister = FaissPersister(delay=FAISS_SAVE_DELAY, max_delay=FAISS_SAVE_MAX_DELAY)
+
+
 class _FaissPool(CachePool):
     def new_vector_store(
         self,
         embed_model: str = EMBEDDING_MODEL,
         embed_device: str = embedding_device(),
+        index_config: Dict = None,
     ) -> FAISS:
         embeddings = EmbeddingsFunAdapter(embed_model)
         doc = Document(page_content="init", metadata={})
         vector_store = FAISS.from_documents([doc], embeddings, normalize_L2=True,distance_strategy="METRIC_INNER_PRODUCT")
         ids = list(vector_store.docstore._dict.keys())
         vector_store.delete(ids)
+        if index_config:
+            vector_store.index = faiss_index.new_index(vector_store.index.d, index_config)
         return vector_store
 
+    def load_sqlite_vector_store(self, item: ThreadSafeFaiss, vs_path: str, embeddings: Embeddings) -> FAISS:
+        '''
+        加载 index.faiss + docstore.sqlite 格式的向量库，文本与 metadata 按 id 从 SQLite 中读取，不需要全部读入内存。
+        FAISS_MMAP_INDEX 为 True 时以 mmap 只读方式打开 IVF 类索引；faiss 只会 mmap IVF 的倒排表，
+        flat 与 HNSW 索引即使指定 mmap 也会完整读入内存，因此直接按普通方式加载
+        '''
+        import faiss
+        index_path = os.path.join(vs_path, "index.faiss")
+        if FAISS_MMAP_INDEX and faiss_index.is_ivf_file(index_path):
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            item._mmap_path = index_path
+        else:
+            index = faiss.read_index(index_path)
+        docstore = SqliteDocstore(os.path.join(vs_path, SqliteDocstore.filename))
+        return FAISS(embeddings, index, docstore, docstore._dict.index_to_docstore_id(),
+                     normalize_L2=True, distance_strategy="METRIC_INNER_PRODUCT")
+
     def save_vector_store(self, kb_name: str, path: str=None):
         if cache := self.get(kb_name):
             return cache.save(path)
@@ -84,27 +578,49 @@ class KBFaissPool(_FaissPool):
         self.atomic.acquire()
         vector_name = vector_name or embed_model
         cache = self.get((kb_name, vector_name)) # 用元组比拼接字符串好一些
+        self.record_lookup((kb_name, vector_name), hit=cache is not None)
         if cache is None:
+            if kb_name in CACHED_VS_PINNED:
+                self.pin((kb_name, vector_name))
             item = ThreadSafeFaiss((kb_name, vector_name), pool=self)
             self.set((kb_name, vector_name), item)
-            with item.acquire(msg="初始化"):
-                self.atomic.release()
-                logger.info(f"loading vector store in '{kb_name}/vector_store/{vector_name}' from disk.")
-                vs_path = get_vs_path(kb_name, vector_name)
-
-                if os.path.isfile(os.path.join(vs_path, "index.faiss")):
-                    embeddings = self.load_kb_embeddings(kb_name=kb_name, embed_device=embed_device, default_embed_model=embed_model)
-                    vector_store = FAISS.load_local(vs_path, embeddings, normalize_L2=True,distance_strategy="METRIC_INNER_PRODUCT")
-                elif create:
-                    # create an empty vector store
-                    if not os.path.exists(vs_path):
-                        os.makedirs(vs_path)
-                    vector_store = self.new_vector_store(embed_model=embed_model, embed_device=embed_device)
-                    vector_store.save_local(vs_path)
-                else:
-                    raise RuntimeError(f"knowledge base {kb_name} not exist.")
-                item.obj = vector_store
+            start = time.perf_counter()
+            try:
+                with item.acquire(msg="初始化"):
+                    self.atomic.release()
+                    logger.info(f"loading vector store in '{kb_name}/vector_store/{vector_name}' from disk.")
+                    vs_path = get_vs_path(kb_name, vector_name)
+                    # 被逐出缓存的旧对象可能还有未写盘的修改，先保存再从磁盘加载
+                    faiss_persister.flush((kb_name, vector_name))
+                    item.index_config = get_kb_index_config(kb_name)
+                    vs_dir = current_vs_dir(vs_path)
+
+                    if os.path.isfile(os.path.join(vs_dir, "index.faiss")):
+                        embeddings = self.load_kb_embeddings(kb_name=kb_name, embed_device=embed_device, default_embed_model=embed_model)
+                        if os.path.isfile(os.path.join(vs_dir, SqliteDocstore.filename)):
+                            vector_store = self.load_sqlite_vector_store(item, vs_dir, embeddings)
+                        else:
+                            vector_store = FAISS.load_local(vs_dir, embeddings, normalize_L2=True,distance_strategy="METRIC_INNER_PRODUCT")
+                        verify_vector_store(f"{kb_name}/{vector_name}", vector_store)
+                    elif create:
+                        # create an empty vector store
+                        if not os.path.exists(vs_path):
+                            os.makedirs(vs_path)
+                        vector_store = self.new_vector_store(embed_model=embed_model, embed_device=embed_device,
+                                                             index_config=item.index_config)
+                        vector_store.save_local(vs_path)
+                    else:
+                        raise RuntimeError(f"knowledge base {kb_name} not exist.")
+                    faiss_index.apply_search_params(vector_store.index, item.index_config)
+                    item.obj = vector_store
+                    item.finish_loading()
+            except Exception:
+                # 加载失败时移出缓存并结束等待，之后的请求重新加载并得到同样的错误，不会一直阻塞在 wait_for_loading
+                self.pop((kb_name, vector_name))
                 item.finish_loading()
+                raise
+            self.record_load(time.perf_counter() - start)
+            self._check_count()  # 加载完成后才知道实际大小，再按内存预算检查一次
         else:
             self.atomic.release()
         return self.get((kb_name, vector_name))
@@ -119,6 +635,7 @@ class MemoFaissPool(_FaissPool):
     ) -> ThreadSafeFaiss:
         self.atomic.acquire()
         cache = self.get(kb_name)
+        self.record_lookup(kb_name, hit=cache is not None)
         if cache is None:
             item = ThreadSafeFaiss(kb_name, pool=self)
             self.set(kb_name, item)
@@ -134,7 +651,7 @@ class MemoFaissPool(_FaissPool):
         return self.get(kb_name)
 
 
-kb_faiss_pool = KBFaissPool(cache_num=CACHED_VS_NUM)
+kb_faiss_pool = KBFaissPool(cache_num=CACHED_VS_NUM, max_bytes=CACHED_VS_MAX_BYTES, policy=CACHED_VS_POLICY)
 memo_faiss_pool = MemoFaissPool(cache_num=CACHED_MEMO_VS_NUM)
 
 
@@ -0,0 +1,222 @@
+from configs import FAISS_INDEX_TYPE, FAISS_INDEX_PARAMS, FAISS_IVF_MIN_VECTORS, logger
+from typing import Dict, List
+import numpy as np
+
+
+# 向量库以 distance_strategy="METRIC_INNER_PRODUCT" 创建，但 langchain 只认 DistanceStrategy.MAX_INNER_PRODUCT，
+# 实际按 L2 距离处理：分数越小越相关，SCORE_THRESHOLD、RRF 等都依赖这一点。
+# 向量已归一化，L2 与内积的排序一致，这里构建的索引统一使用 L2，与 FAISS.from_documents 创建的 IndexFlatL2 相同
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def normalize_index_config(config: Dict = None) -> Dict:
+    '''
+    补全知识库的索引配置：未指定 type 时使用 FAISS_INDEX_TYPE，未指定的参数使用 FAISS_INDEX_PARAMS 中的默认值
+    '''
+    config = dict(config or {})
+    index_type = str(config.pop("type", None) or FAISS_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型：{index_type}，可选：{', '.join(INDEX_TYPES)}")
+    params = dict(FAISS_INDEX_PARAMS.get(index_type, {}))
+    params.update(config)
+    params["type"] = index_type
+    return params
+
+
+def _pq_subquantizers(d: int, m: int) -> int:
+    # PQ 要求向量维度能被子量化器数量整除，取不大于 m 的最大因数
+    m = max(1, min(int(m), d))
+    while d % m:
+        m -= 1
+    return m
+
+
+def new_index(d: int, config: Dict = None):
+    '''
+    新建空索引。hnsw 无需训练，直接使用；IVF 类索引需要训练数据，在 build_index 之前先使用 flat 索引。
+    返回的索引按 label 保存向量（见 is_id_mapped）
+    '''
+    import faiss
+    config = normalize_index_config(config)
+    if config["type"] == "hnsw":
+        index = faiss.index_factory(d, f"HNSW{config['M']},Flat", faiss.METRIC_L2)
+        index.hnsw.efConstruction = config["ef_construction"]
+    else:
+        index = faiss.IndexFlatL2(d)
+    index = faiss.IndexIDMap2(index)
+    apply_search_params(index, config)
+    return index
+
+
+def build_index(d: int, config: Dict, vectors: np.ndarray, labels: List[int] = None):
+    '''
+    按 config 构建索引并添加 vectors，labels 为各向量的 label（默认依次为 0, 1, 2...），IVF 类索引以 vectors 为训练数据。
+    向量数少于 FAISS_IVF_MIN_VECTORS 时 IVF 的聚类没有意义，保持 flat 索引
+    '''
+    import faiss
+    config = normalize_index_config(config)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    labels = np.arange(n, dtype=np.int64) if labels is None else np.asarray(labels, dtype=np.int64)
+    if config["type"] in ("ivf_flat", "ivf_pq") and n >= FAISS_IVF_MIN_VECTORS:
+        # faiss 建议每个聚类中心至少有 39 个训练样本
+        nlist = max(1, min(int(config["nlist"]), n // 39))
+        if config["type"] == "ivf_flat":
+            description = f"IVF{nlist},Flat"
+        else:
+            description = f"IVF{nlist},PQ{_pq_subquantizers(d, config['m'])}x{config['nbits']}"
+        index = faiss.index_factory(d, description, faiss.METRIC_L2)
+        index.train(vectors)
+        # IVF 本身按 id 保存向量；哈希表形式的 direct map 支持按 label 取回向量，也支持删除
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        logger.info(f"已训练索引 {description}，训练样本数：{n}")
+    else:
+        if config["type"] != "hnsw" and config["type"] != "flat":
+            logger.info(f"向量数 {n} 少于 {FAISS_IVF_MIN_VECTORS}，暂不训练 {config['type']} 索引，使用 flat 索引")
+        index = new_index(d, config)
+    if n:
+        index.add_with_ids(vectors, labels)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index, config: Dict = None):
+    '''
+    设置检索参数：IVF 的 nprobe 与 HNSW 的 efSearch。参数保存在知识库配置中而不是索引文件里，每次加载后都需要设置
+    '''
+    import faiss
+    config = normalize_index_config(config)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and "nprobe" in config:
+        ivf.nprobe = int(config["nprobe"])
+    inner = _inner_index(index)
+    if hasattr(inner, "hnsw") and "ef_search" in config:
+        inner.hnsw.efSearch = int(config["ef_search"])
+
+
+def _inner_index(index):
+    import faiss
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def _empty_like(index):
+    # 与 index 参数相同的空 flat 或 HNSW 索引
+    import faiss
+    if hasattr(index, "hnsw"):
+        empty = faiss.IndexHNSWFlat(index.d, index.hnsw.nb_neighbors(1), index.metric_type)
+        empty.hnsw.efConstruction = index.hnsw.efConstruction
+        empty.hnsw.efSearch = index.hnsw.efSearch
+        return empty
+    return faiss.IndexFlat(index.d, index.metric_type)
+
+
+def is_id_mapped(index) -> bool:
+    '''
+    索引是否按 label 保存向量：IndexIDMap2 与 IVF 类索引。这类索引中 index_to_docstore_id 的键是 label，
+    删除向量后其余向量的 label 不变；否则（langchain 创建的 IndexFlat）键是向量在索引中的位置
+    '''
+    import faiss
+    return isinstance(index, faiss.IndexIDMap2) or faiss.try_extract_index_ivf(index) is not None
+
+
+def to_id_mapped(index):
+    '''
+    将按位置保存的索引转换为 IndexIDMap2，label 即原来的位置，index_to_docstore_id 无需修改。
+    每个向量库只在第一次删除时转换一次
+    '''
+    import faiss
+    if is_id_mapped(index):
+        return index
+    vectors = reconstruct_labels(index, np.arange(index.ntotal))
+    mapped = faiss.IndexIDMap2(_empty_like(index))
+    if len(vectors):
+        mapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    return mapped
+
+
+def next_label(index, labels) -> int:
+    '''
+    下一个可用的 label：大于 labels（index_to_docstore_id 的键）以及 HNSW 中已标记删除的所有 label
+    '''
+    import faiss
+    n = max(labels, default=-1) + 1
+    if isinstance(index, faiss.IndexIDMap2) and index.ntotal:
+        n = max(n, int(faiss.vector_to_array(index.id_map).max()) + 1)
+    elif not is_id_mapped(index):
+        n = max(n, index.ntotal)
+    return n
+
+
+def add_vectors(index, vectors: np.ndarray, labels: List[int]):
+    '''
+    按 labels 添加向量。按位置保存的索引只能追加到末尾，调用方需保证 labels 从 ntotal 开始依次递增
+    '''
+    if is_id_mapped(index):
+        index.add_with_ids(vectors, np.asarray(labels, dtype=np.int64))
+    else:
+        index.add(vectors)
+
+
+def reconstruct_labels(index, labels: List[int]) -> np.ndarray:
+    '''
+    按顺序取出指定 label 的向量（ivf_pq 为量化后的近似值）
+    '''
+    import faiss
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(labels) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if not is_id_mapped(index):
+        return index.reconstruct_n(0, index.ntotal)[labels]
+    ivf = None if isinstance(index, faiss.IndexIDMap2) else faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Hashtable:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index.reconstruct_batch(labels)
+
+
+def is_hnsw(index) -> bool:
+    return hasattr(_inner_index(index), "hnsw")
+
+
+def is_ivf_file(path: str) -> bool:
+    '''
+    按文件头判断 index.faiss 是否为 IVF 类索引（fourcc 以 "Iw" 开头），只读取前两个字节
+    '''
+    with open(path, "rb") as f:
+        return f.read(2) == b"Iw"
+
+
+def invlists_on_disk(index) -> bool:
+    '''
+    IVF 的倒排表是否在磁盘上（mmap 打开时为 OnDiskInvertedLists），此时向量不占用常驻内存
+    '''
+    import faiss
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+
+def remove_labels(index, labels: List[int]):
+    '''
+    删除指定 label 的向量，其余向量的 label 不变。index 需为 is_id_mapped 的索引。
+    flat 与 IVF 直接 remove_ids，开销为 C++ 中一次 O(N) 的扫描，不需要重建。
+    HNSW 不支持删除，向量作为“已删除”标记留在图中：调用方从 index_to_docstore_id 中去掉这些 label，
+    检索时跳过，标记过多时再用 compact 重建（见 FAISS_HNSW_REBUILD_RATIO）
+    '''
+    if not is_hnsw(index):
+        index.remove_ids(np.asarray(labels, dtype=np.int64))
+
+
+def compact(index, labels: List[int]):
+    '''
+    只保留指定 label 的向量重新构建 HNSW 图，去掉已删除的向量，返回新的索引
+    '''
+    import faiss
+    remaining = np.asarray(labels, dtype=np.int64)
+    vectors = reconstruct_labels(index, remaining)
+    rebuilt = faiss.IndexIDMap2(_empty_like(_inner_index(index)))
+    if len(remaining):
+        rebuilt.add_with_ids(vectors, remaining)
+    return rebuilt
@@ -0,0 +1,214 @@
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Tuple
+import json
+import os
+import sqlite3
+import threading
+
+
+def _source_key(metadata: Dict) -> str:
+    return str(metadata.get("source", "")).lower()
+
+
+class SqliteDocDict(MutableMapping):
+    '''
+    以 SQLite 文件为底、内存中叠加修改的 {id: Document} 映射。
+    文件以只读方式打开，按 id 查询时才读取对应文本；新增的文档保存在 _added 中，
+    删除的文件中文档记录在 _deleted 中，直到下一次保存时写入新文件并 reopen。
+    '''
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._added: Dict[str, Document] = {}
+        self._deleted = set()
+        self._conn = None
+        self._count = 0
+        self.path = None
+        self.reopen(path)
+
+    def reopen(self, path: str):
+        '''
+        切换到新保存的文件，新文件已包含全部修改，因此清空内存中的叠加层
+        '''
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = conn
+            self.path = path
+            self._count = conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            self._added.clear()
+            self._deleted.clear()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def _stream(path: str, sql: str) -> Iterator[tuple]:
+        '''
+        用独立的连接逐行读取，遍历期间不占用锁，也不会一次把全部文本读入内存
+        '''
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            yield from conn.execute(sql)
+        finally:
+            conn.close()
+
+    def _in_base(self, key: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM docs WHERE id = ?", (key,)).fetchone() is not None
+
+    def __getitem__(self, key: str) -> Document:
+        with self._lock:
+            if key in self._added:
+                return self._added[key]
+            if key in self._deleted:
+                raise KeyError(key)
+            row = self._conn.execute("SELECT page_content, metadata FROM docs WHERE id = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def get_many(self, keys: List[str], chunk_size: int = 500) -> List[Document]:
+        '''
+        批量读取，每 chunk_size 个 id 一次查询（SQLite 默认最多 999 个参数）。结果与 keys 对应，不存在的为 None
+        '''
+        found: Dict[str, Document] = {}
+        with self._lock:
+            pending = []
+            for key in keys:
+                if key in self._added:
+                    found[key] = self._added[key]
+                elif key not in self._deleted:
+                    pending.append(key)
+            for i in range(0, len(pending), chunk_size):
+                chunk = pending[i:i + chunk_size]
+                sql = f"SELECT id, page_content, metadata FROM docs WHERE id IN ({','.join('?' * len(chunk))})"
+                for key, page_content, metadata in self._conn.execute(sql, chunk):
+                    found[key] = Document(page_content=page_content, metadata=json.loads(metadata))
+        return [found.get(key) for key in keys]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            if key in self._added:
+                return True
+            if key in self._deleted:
+                return False
+            return self._in_base(key)
+
+    def __setitem__(self, key: str, doc: Document):
+        with self._lock:
+            if key not in self:
+                self._count += 1
+            self._added[key] = doc
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._added.pop(key, None)
+            if self._in_base(key):
+                self._deleted.add(key)
+            self._count -= 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _ in self.items():
+            yield key
+
+    def items(self) -> Iterator[Tuple[str, Document]]:
+        '''
+        按文件顺序读取全部文档，内存中只保留当前这一条
+        '''
+        with self._lock:
+            rows = self._stream(self.path, "SELECT id, page_content, metadata FROM docs ORDER BY pos")
+            added = dict(self._added)
+            deleted = set(self._deleted)
+        for key, page_content, metadata in rows:
+            if key in deleted or key in added:
+                continue
+            yield key, Document(page_content=page_content, metadata=json.loads(metadata))
+        yield from added.items()
+
+    def keys(self) -> List[str]:
+        return list(iter(self))
+
+    def values(self) -> Iterator[Document]:
+        for _, doc in self.items():
+            yield doc
+
+    def source_items(self) -> Iterator[Tuple[str, str]]:
+        '''
+        返回 (id, 小写的 metadata["source"])，构建来源索引时无需读取文本
+        '''
+        with self._lock:
+            rows = self._stream(self.path, "SELECT id, source FROM docs")
+            added = {k: _source_key(v.metadata) for k, v in self._added.items()}
+            deleted = set(self._deleted)
+        for key, source in rows:
+            if key not in deleted and key not in added:
+                yield key, source
+        yield from added.items()
+
+    def index_to_docstore_id(self) -> Dict[int, str]:
+        with self._lock:
+            return {pos: key for pos, key in self._conn.execute("SELECT pos, id FROM docs")}
+
+
+class SqliteDocstore(InMemoryDocstore):
+    '''
+    文本与 metadata 保存在 SQLite 文件中、按 id 延迟读取的 docstore，
+    接口与 InMemoryDocstore 相同（包括 _dict），可直接替换 FAISS.docstore。
+    '''
+    filename = "docstore.sqlite"
+
+    def __init__(self, path: str):
+        self._dict = SqliteDocDict(path)
+
+    @property
+    def path(self) -> str:
+        return self._dict.path
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        # InMemoryDocstore.add 与 _dict 求交集会遍历全部文档，这里逐个判断
+        overlapping = [key for key in texts if key in self._dict]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for key, doc in texts.items():
+            self._dict[key] = doc
+
+    def delete(self, ids: List) -> None:
+        missing = [key for key in ids if key not in self._dict]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not  exist: {missing}")
+        for key in ids:
+            del self._dict[key]
+
+    def reopen(self, path: str):
+        self._dict.reopen(path)
+
+    @staticmethod
+    def dump(docstore: InMemoryDocstore, index_to_docstore_id: Dict[int, str], path: str):
+        '''
+        将任意 InMemoryDocstore（包括 SqliteDocstore）与 FAISS 位置映射写入新的 SQLite 文件
+        '''
+        positions = {key: pos for pos, key in index_to_docstore_id.items()}
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("CREATE TABLE docs ("
+                         "id TEXT PRIMARY KEY, pos INTEGER, source TEXT, page_content TEXT, metadata TEXT)")
+            rows = ((key, positions.get(key), _source_key(doc.metadata), doc.page_content,
+                     json.dumps(doc.metadata, ensure_ascii=False, default=str))
+                    for key, doc in docstore._dict.items())
+            conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("CREATE INDEX docs_pos ON docs (pos)")
+            conn.commit()
+        finally:
+            conn.close()
@@ -13,6 +13,8 @@ from sse_starlette import EventSourceResponse
 from pydantic import Json
 import json
 from server.knowledge_base.kb_service.base import KBServiceFactory
+from server.knowledge_base.ingest import IngestPipeline
+from server.knowledge_base.kb_cache.faiss_index import normalize_index_config
 from server.db.repository.knowledge_file_repository import get_file_detail
 from langchain.docstore.document import Document
 from server.knowledge_base.model.kb_document_model import DocumentWithVSId
@@ -42,6 +44,28 @@ def search_docs(
     return data
 
 
+def search_docs_batch(
+        queries: List[str] = Body(..., description="用户输入列表", examples=[["你好", "如何启动api服务"]]),
+        knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
+        top_k: int = Body(VECTOR_SEARCH_TOP_K, description="匹配向量数"),
+        score_threshold: float = Body(SCORE_THRESHOLD,
+                                      description="知识库匹配相关度阈值，取值范围在0-1之间，"
+                                                  "SCORE越小，相关度越高，"
+                                                  "取到1相当于不筛选，建议设置在0.5左右",
+                                      ge=0, le=1),
+) -> List[List[DocumentWithVSId]]:
+    '''
+    批量检索知识库：所有查询一次性向量化并检索，返回结果与 queries 一一对应
+    '''
+    kb = KBServiceFactory.get_service_by_name(knowledge_base_name)
+    data = []
+    if kb is not None:
+        results = kb.search_docs_batch(queries, top_k, score_threshold)
+        data = [[DocumentWithVSId(**x[0].dict(), score=x[1], id=x[0].metadata.get("id")) for x in docs]
+                for docs in results]
+    return data
+
+
 def update_docs_by_id(
         knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
         docs: Dict[str, Document] = Body(..., description="要更新的文档内容，形如：{id: Document, ...}")
@@ -270,19 +294,13 @@ def update_docs(
                              exc_info=e if log_verbose else None)
                 failed_files[file_name] = msg
 
-    # 从文件生成docs，并进行向量化。
-    # 这里利用了KnowledgeFile的缓存功能，在多线程中加载Document，然后传给KnowledgeFile
-    for status, result in files2docs_in_thread(kb_files,
-                                               chunk_size=chunk_size,
-                                               chunk_overlap=chunk_overlap,
-                                               zh_title_enhance=zh_title_enhance):
-        if status:
-            kb_name, file_name, new_docs = result
-            kb_file = KnowledgeFile(filename=file_name,
-                                    knowledge_base_name=knowledge_base_name)
-            kb_file.splited_docs = new_docs
-            kb.update_doc(kb_file, not_refresh_vs_cache=True)
-        else:
+    # 从文件生成docs，并进行向量化。解析、向量化与写入向量库在流水线中同时进行
+    pipeline = IngestPipeline(kb,
+                              chunk_size=chunk_size,
+                              chunk_overlap=chunk_overlap,
+                              zh_title_enhance=zh_title_enhance)
+    for status, result in pipeline.run(kb_files):
+        if not status:
             kb_name, file_name, error = result
             failed_files[file_name] = error
 
@@ -353,6 +371,7 @@ def recreate_vector_store(
         chunk_overlap: int = Body(OVERLAP_SIZE, description="知识库中相邻文本重合长度"),
         zh_title_enhance: bool = Body(ZH_TITLE_ENHANCE, description="是否开启中文标题加强"),
         not_refresh_vs_cache: bool = Body(False, description="暂不保存向量库（用于FAISS）"),
+        index_config: dict = Body(None, description="新的向量索引配置（用于FAISS），为空时沿用知识库原有配置"),
 ):
     """
     recreate vector store from the content.
@@ -366,20 +385,27 @@ def recreate_vector_store(
         if not kb.exists() and not allow_empty_kb:
             yield {"code": 404, "msg": f"未找到知识库 ‘{knowledge_base_name}’"}
         else:
+            if index_config is not None:
+                try:
+                    normalize_index_config(index_config)  # 在清空向量库之前检查配置
+                except ValueError as e:
+                    yield json.dumps({"code": 403, "msg": str(e)}, ensure_ascii=False)
+                    return
             if kb.exists():
                 kb.clear_vs()
             kb.create_kb()
+            if index_config is not None:
+                kb.update_index_config(index_config)
             files = list_files_from_folder(knowledge_base_name)
             kb_files = [(file, knowledge_base_name) for file in files]
             i = 0
-            for status, result in files2docs_in_thread(kb_files,
-                                                       chunk_size=chunk_size,
-                                                       chunk_overlap=chunk_overlap,
-                                                       zh_title_enhance=zh_title_enhance):
+            pipeline = IngestPipeline(kb,
+                                      chunk_size=chunk_size,
+                                      chunk_overlap=chunk_overlap,
+                                      zh_title_enhance=zh_title_enhance)
+            for status, result in pipeline.run(kb_files):
                 if status:
-                    kb_name, file_name, docs = result
-                    kb_file = KnowledgeFile(filename=file_name, knowledge_base_name=kb_name)
-                    kb_file.splited_docs = docs
+                    kb_name, file_name, docs_count = result
                     yield json.dumps({
                         "code": 200,
                         "msg": f"({i + 1} / {len(files)}): {file_name}",
@@ -387,7 +413,6 @@ def recreate_vector_store(
                         "finished": i + 1,
                         "doc": file_name,
                     }, ensure_ascii=False)
-                    kb.add_doc(kb_file, not_refresh_vs_cache=True)
                 else:
                     kb_name, file_name, error = result
                     msg = f"添加文件‘{file_name}’到知识库‘{knowledge_base_name}’时出错：{error}。已跳过。"
@@ -397,6 +422,7 @@ def recreate_vector_store(
                         "msg": msg,
                     })
                 i += 1
+            kb.build_index()
             if not not_refresh_vs_cache:
                 kb.save_vector_store()
 
@@ -2,6 +2,8 @@ import operator
 from abc import ABC, abstractmethod
 
 import os
+import threading
+import time
 from pathlib import Path
 import numpy as np
 from langchain.embeddings.base import Embeddings
@@ -9,7 +11,7 @@ from langchain.docstore.document import Document
 
 from server.db.repository.knowledge_base_repository import (
     add_kb_to_db, delete_kb_from_db, list_kbs_from_db, kb_exists,
-    load_kb_from_db, get_kb_detail,
+    load_kb_from_db, get_kb_detail, update_kb_index_config,
 )
 from server.db.repository.knowledge_file_repository import (
     add_file_to_db, delete_file_from_db, delete_files_from_db, file_exists_in_db,
@@ -18,26 +20,29 @@ from server.db.repository.knowledge_file_repository import (
 )
 
 from configs import (kbs_config, VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD,
-                     EMBEDDING_MODEL, KB_INFO)
+                     EMBEDDING_MODEL, KB_INFO, KB_SERVICE_CACHE_TTL)
 from server.knowledge_base.utils import (
     get_kb_path, get_doc_path, KnowledgeFile,
     list_kbs_from_folder, list_files_from_folder,
 )
 
-from typing import List, Union, Dict, Optional, Tuple
+from typing import Iterator, List, Union, Dict, Optional, Tuple
 
-from server.embeddings_api import embed_texts, aembed_texts, embed_documents
+from server.embeddings_api import embed_texts, aembed_texts, embed_documents, query_embedding_cache
+from server.utils import thread_pool
+from server.knowledge_base.kb_cache.base import search_result_cache
 from server.knowledge_base.model.kb_document_model import DocumentWithVSId
 
 
-def normalize(embeddings: List[List[float]]) -> np.ndarray:
+def normalize(embeddings: Union[List[List[float]], np.ndarray]) -> np.ndarray:
     '''
     sklearn.preprocessing.normalize 的替代（使用 L2），避免安装 scipy, scikit-learn
+    返回 C 连续的 float32 矩阵。传入的已经是 float32 连续矩阵时直接原地归一化，不产生副本。
     '''
-    norm = np.linalg.norm(embeddings, axis=1)
-    norm = np.reshape(norm, (norm.shape[0], 1))
-    norm = np.tile(norm, (1, len(embeddings[0])))
-    return np.divide(embeddings, norm)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norm = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norm, out=embeddings, where=norm != 0)
+    return embeddings
 
 
 class SupportedVSType:
@@ -50,6 +55,8 @@ class SupportedVSType:
 
 
 class KBService(ABC):
+    # do_add_embeddings 是否直接使用传入的向量。为 False 时入库流水线不预先向量化，由 do_add_doc 自行处理
+    accepts_embeddings: bool = False
 
     def __init__(self,
                  knowledge_base_name: str,
@@ -79,13 +86,29 @@ class KBService(ABC):
             os.makedirs(self.doc_path)
         self.do_create_kb()
         status = add_kb_to_db(self.kb_name, self.kb_info, self.vs_type(), self.embed_model)
+        KBServiceFactory.invalidate(self.kb_name)
         return status
 
+    def update_index_config(self, index_config: Dict):
+        """
+        更新知识库的向量索引配置。索引类型在下一次 build_index 时生效
+        """
+        status = update_kb_index_config(self.kb_name, index_config)
+        KBServiceFactory.invalidate(self.kb_name)
+        return status
+
+    def build_index(self):
+        """
+        重建向量库后按索引配置构建检索索引（如训练 FAISS 的 IVF 索引）。其他向量库的索引由服务端管理，无需处理
+        """
+        pass
+
     def clear_vs(self):
         """
         删除向量库中所有内容
         """
         self.do_clear_vs()
+        search_result_cache.invalidate(self.kb_name)
         status = delete_files_from_db(self.kb_name)
         return status
 
@@ -94,7 +117,9 @@ class KBService(ABC):
         删除知识库
         """
         self.do_drop_kb()
+        search_result_cache.invalidate(self.kb_name)
         status = delete_kb_from_db(self.kb_name)
+        KBServiceFactory.invalidate(self.kb_name)
         return status
 
     def _docs_to_embeddings(self, docs: List[Document]) -> Dict:
@@ -117,17 +142,12 @@ class KBService(ABC):
             custom_docs = False
 
         if docs:
-            # 将 metadata["source"] 改为相对路径
-            for doc in docs:
-                try:
-                    source = doc.metadata.get("source", "")
-                    if os.path.isabs(source):
-                        rel_path = Path(source).relative_to(self.doc_path)
-                        doc.metadata["source"] = str(rel_path.as_posix().strip("/"))
-                except Exception as e:
-                    print(f"cannot convert absolute path ({source}) to relative path. error is : {e}")
+            self.relative_sources(docs)
             self.delete_doc(kb_file)
-            doc_infos = self.do_add_doc(docs, **kwargs)
+            try:
+                doc_infos = self.do_add_doc(docs, **kwargs)
+            finally:
+                search_result_cache.invalidate(self.kb_name)
             status = add_file_to_db(kb_file,
                                     custom_docs=custom_docs,
                                     docs_count=len(docs),
@@ -136,11 +156,27 @@ class KBService(ABC):
             status = False
         return status
 
+    def relative_sources(self, docs: List[Document]):
+        '''
+        将 metadata["source"] 改为相对路径
+        '''
+        for doc in docs:
+            try:
+                source = doc.metadata.get("source", "")
+                if os.path.isabs(source):
+                    rel_path = Path(source).relative_to(self.doc_path)
+                    doc.metadata["source"] = str(rel_path.as_posix().strip("/"))
+            except Exception as e:
+                print(f"cannot convert absolute path ({source}) to relative path. error is : {e}")
+
     def delete_doc(self, kb_file: KnowledgeFile, delete_content: bool = False, **kwargs):
         """
         从知识库删除文件
         """
-        self.do_delete_doc(kb_file, **kwargs)
+        try:
+            self.do_delete_doc(kb_file, **kwargs)
+        finally:
+            search_result_cache.invalidate(self.kb_name)
         status = delete_file_from_db(kb_file)
         if delete_content and os.path.exists(kb_file.filepath):
             os.remove(kb_file.filepath)
@@ -152,6 +188,7 @@ class KBService(ABC):
         """
         self.kb_info = kb_info
         status = add_kb_to_db(self.kb_name, self.kb_info, self.vs_type(), self.embed_model)
+        KBServiceFactory.invalidate(self.kb_name)
         return status
 
     def update_doc(self, kb_file: KnowledgeFile, docs: List[Document] = [], **kwargs):
@@ -178,11 +215,39 @@ class KBService(ABC):
                     top_k: int = VECTOR_SEARCH_TOP_K,
                     score_threshold: float = SCORE_THRESHOLD,
                     ) ->List[Document]:
-        docs = self.do_search(query, top_k, score_threshold)
+        key = search_result_cache.make_key(self.kb_name, self.embed_model, query, top_k, score_threshold)
+        docs = search_result_cache.get(key)
+        if docs is None:
+            docs = self.do_search(query, top_k, score_threshold)
+            search_result_cache.set(key, docs)
         return docs
 
+    def search_docs_batch(self,
+                          queries: List[str],
+                          top_k: int = VECTOR_SEARCH_TOP_K,
+                          score_threshold: float = SCORE_THRESHOLD,
+                          ) -> List[List[Tuple[Document, float]]]:
+        '''
+        同时检索多个查询，返回结果与 queries 一一对应。已缓存的查询直接返回，其余查询合并检索
+        '''
+        if not queries:
+            return []
+        keys = [search_result_cache.make_key(self.kb_name, self.embed_model, q, top_k, score_threshold)
+                for q in queries]
+        results = [search_result_cache.get(key) for key in keys]
+        missing = [i for i, docs in enumerate(results) if docs is None]
+        if missing:
+            searched = self.do_search_batch([queries[i] for i in missing], top_k, score_threshold)
+            for i, docs in zip(missing, searched):
+                search_result_cache.set(keys[i], docs)
+                results[i] = docs
+        return results
+
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
-        return []
+        '''
+        批量获取文档，返回结果与 ids 一一对应，不存在的 id 对应 None。子类应在一次加锁或一次查询中完成
+        '''
+        return [None] * len(ids)
 
     def del_doc_by_ids(self, ids: List[str]) -> bool:
         raise NotImplementedError
@@ -192,34 +257,42 @@ class KBService(ABC):
         传入参数为： {doc_id: Document, ...}
         如果对应 doc_id 的值为 None，或其 page_content 为空，则删除该文档
         '''
-        self.del_doc_by_ids(list(docs.keys()))
-        docs = []
-        ids = []
-        for k, v in docs.items():
-            if not v or not v.page_content.strip():
-                continue
-            ids.append(k)
-            docs.append(v)
-        self.do_add_doc(docs=docs, ids=ids)
+        try:
+            self.del_doc_by_ids(list(docs.keys()))
+            docs = []
+            ids = []
+            for k, v in docs.items():
+                if not v or not v.page_content.strip():
+                    continue
+                ids.append(k)
+                docs.append(v)
+            self.do_add_doc(docs=docs, ids=ids)
+        finally:
+            search_result_cache.invalidate(self.kb_name)
         return True
 
     def list_docs(self, file_name: str = None, metadata: Dict = {}) -> List[DocumentWithVSId]:
         '''
         通过file_name或metadata检索Document
         '''
-        doc_infos = list_docs_from_db(kb_name=self.kb_name, file_name=file_name, metadata=metadata)
-        docs = []
-        for x in doc_infos:
-            doc_info = self.get_doc_by_ids([x["id"]])[0]
-            if doc_info is not None:
-                # 处理非空的情况
-                doc_with_id = DocumentWithVSId(**doc_info.dict(), id=x["id"])
-                docs.append(doc_with_id)
-            else:
-                # 处理空的情况
-                # 可以选择跳过当前循环迭代或执行其他操作
-                pass
-        return docs
+        return list(self.iter_docs(file_name=file_name, metadata=metadata))
+
+    def iter_docs(
+            self,
+            file_name: str = None,
+            metadata: Dict = {},
+            batch_size: int = 1000,
+    ) -> Iterator[DocumentWithVSId]:
+        '''
+        与 list_docs 相同，但每 batch_size 个 id 调用一次 get_doc_by_ids 并逐个返回，
+        大文件不需要一次把全部文档读入内存。向量库中已不存在的文档被跳过
+        '''
+        ids = [x["id"] for x in list_docs_from_db(kb_name=self.kb_name, file_name=file_name, metadata=metadata)]
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            for id, doc in zip(batch, self.get_doc_by_ids(batch)):
+                if doc is not None:
+                    yield DocumentWithVSId(**doc.dict(), id=id)
 
     @abstractmethod
     def do_create_kb(self):
@@ -266,6 +339,16 @@ class KBService(ABC):
         """
         pass
 
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float,
+                        ) -> List[List[Tuple[Document, float]]]:
+        """
+        批量搜索知识库，默认在线程池中并发执行 do_search，子类可实现更高效的批量检索
+        """
+        return list(thread_pool.map(lambda q: self.do_search(q, top_k, score_threshold), queries))
+
     @abstractmethod
     def do_add_doc(self,
                    docs: List[Document],
@@ -276,6 +359,16 @@ class KBService(ABC):
         """
         pass
 
+    def do_add_embeddings(self,
+                          docs: List[Document],
+                          embeddings: Optional[np.ndarray],
+                          **kwargs,
+                          ) -> List[Dict]:
+        """
+        添加已经向量化的文档，返回值与 do_add_doc 相同。accepts_embeddings 为 False 的向量库忽略 embeddings
+        """
+        return self.do_add_doc(docs, **kwargs)
+
     @abstractmethod
     def do_delete_doc(self,
                       kb_file: KnowledgeFile):
@@ -293,6 +386,10 @@ class KBService(ABC):
 
 
 class KBServiceFactory:
+    # kb_name -> (创建时间, KBService)，避免每次请求都查询数据库并重新初始化向量库连接
+    _services: Dict[str, Tuple[float, KBService]] = {}
+    _generation = 0  # 每次失效加一，避免把加载期间已失效的结果写入缓存
+    _lock = threading.Lock()
 
     @staticmethod
     def get_service(kb_name: str,
@@ -323,12 +420,36 @@ class KBServiceFactory:
             from server.knowledge_base.kb_service.default_kb_service import DefaultKBService
             return DefaultKBService(kb_name)
 
-    @staticmethod
-    def get_service_by_name(kb_name: str) -> KBService:
+    @classmethod
+    def get_service_by_name(cls, kb_name: str) -> KBService:
+        item = cls._services.get(kb_name)
+        if item is not None and not (KB_SERVICE_CACHE_TTL and time.time() - item[0] > KB_SERVICE_CACHE_TTL):
+            return item[1]
+
+        generation = cls._generation
         _, vs_type, embed_model = load_kb_from_db(kb_name)
         if _ is None:  # kb not in db, just return None
+            cls.invalidate(kb_name)
             return None
-        return KBServiceFactory.get_service(kb_name, vs_type, embed_model)
+        service = cls.get_service(kb_name, vs_type, embed_model)
+        with cls._lock:
+            if generation == cls._generation:
+                cls._services[kb_name] = (time.time(), service)
+        return service
+
+    @classmethod
+    def invalidate(cls, kb_name: str = None):
+        '''
+        删除缓存的 KBService，kb_name 为 None 时清空全部缓存
+        '''
+        with cls._lock:
+            cls._generation += 1
+            if kb_name is None:
+                cls._services.clear()
+            else:
+                # load_kb_from_db 使用 ilike 匹配知识库名称，这里同样忽略大小写
+                for name in [k for k in cls._services if k.lower() == kb_name.lower()]:
+                    cls._services.pop(name, None)
 
     @staticmethod
     def get_default():
@@ -420,22 +541,42 @@ class EmbeddingsFunAdapter(Embeddings):
         return normalize(embeddings).tolist()
 
     def embed_query(self, text: str) -> List[float]:
+        cached = query_embedding_cache.get(self.embed_model, text)
+        if cached is not None:
+            return cached.tolist()
         embeddings = embed_texts(texts=[text], embed_model=self.embed_model, to_query=True).data
-        query_embed = embeddings[0]
-        query_embed_2d = np.reshape(query_embed, (1, -1))  # 将一维数组转换为二维数组
-        normalized_query_embed = normalize(query_embed_2d)
-        return normalized_query_embed[0].tolist()  # 将结果转换为一维数组并返回
+        query_embed = normalize(embeddings)[0]
+        query_embedding_cache.set(self.embed_model, text, query_embed)
+        return query_embed.tolist()
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        '''
+        一次性向量化多个查询，返回归一化后的 float32 矩阵，可直接交给 FAISS 检索。
+        已缓存的查询不再送入模型，其余查询合并为一次 embed_texts 调用。
+        '''
+        cached = [query_embedding_cache.get(self.embed_model, text) for text in texts]
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            embeddings = embed_texts(texts=[texts[i] for i in missing],
+                                     embed_model=self.embed_model,
+                                     to_query=True).data
+            for i, query_embed in zip(missing, normalize(embeddings)):
+                query_embedding_cache.set(self.embed_model, texts[i], query_embed)
+                cached[i] = query_embed
+        return np.ascontiguousarray(np.stack(cached), dtype=np.float32)
 
     async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
         embeddings = (await aembed_texts(texts=texts, embed_model=self.embed_model, to_query=False)).data
         return normalize(embeddings).tolist()
 
     async def aembed_query(self, text: str) -> List[float]:
+        cached = query_embedding_cache.get(self.embed_model, text)
+        if cached is not None:
+            return cached.tolist()
         embeddings = (await aembed_texts(texts=[text], embed_model=self.embed_model, to_query=True)).data
-        query_embed = embeddings[0]
-        query_embed_2d = np.reshape(query_embed, (1, -1))  # 将一维数组转换为二维数组
-        normalized_query_embed = normalize(query_embed_2d)
-        return normalized_query_embed[0].tolist()  # 将结果转换为一维数组并返回
+        query_embed = normalize(embeddings)[0]
+        query_embedding_cache.set(self.embed_model, text, query_embed)
+        return query_embed.tolist()
 
 
 def score_threshold_process(score_threshold, k, docs):
@@ -449,3 +590,23 @@ def score_threshold_process(score_threshold, k, docs):
             if cmp(similarity, score_threshold)
         ]
     return docs[:k]
+
+
+def reciprocal_rank_fusion(
+        results: List[List[DocumentWithVSId]],
+        k: int = 60,
+) -> List[DocumentWithVSId]:
+    '''
+    对多个查询的检索结果做 RRF 融合：按向量库 id 去重（无 id 时按文本去重），
+    按 sum(1 / (k + rank)) 从高到低排序，每个文档保留其最佳（最小）的 score
+    '''
+    fused_scores = {}
+    fused_docs = {}
+    for docs in results:
+        for rank, doc in enumerate(docs):
+            key = doc.id or doc.page_content
+            fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            if key not in fused_docs or doc.score < fused_docs[key].score:
+                fused_docs[key] = doc
+    keys = sorted(fused_scores, key=lambda x: fused_scores[x], reverse=True)
+    return [fused_docs[key] for key in keys]
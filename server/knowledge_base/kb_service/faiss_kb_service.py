@@ -3,17 +3,22 @@ import shutil
 
 from configs import SCORE_THRESHOLD
 from server.knowledge_base.kb_service.base import KBService, SupportedVSType, EmbeddingsFunAdapter
-from server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool, ThreadSafeFaiss
+from server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool, faiss_persister, ThreadSafeFaiss
+from server.knowledge_base.kb_cache import faiss_index
+from server.knowledge_base.kb_cache.sqlite_docstore import SqliteDocstore
+from server.db.repository.knowledge_base_repository import get_kb_index_config
 from server.knowledge_base.utils import KnowledgeFile, get_kb_path, get_vs_path
 from server.utils import torch_gc
 from langchain.docstore.document import Document
 from typing import List, Dict, Optional, Tuple
+import numpy as np
 
 
 class FaissKBService(KBService):
     vs_path: str
     kb_path: str
     vector_name: str = None
+    accepts_embeddings = True
  
     def vs_type(self) -> str:
         return SupportedVSType.FAISS
@@ -30,15 +35,29 @@ class FaissKBService(KBService):
                                                embed_model=self.embed_model)
 
     def save_vector_store(self):
+        faiss_persister.discard((self.kb_name, self.vector_name))
         self.load_vector_store().save(self.vs_path)
 
+    def update_index_config(self, index_config: Dict):
+        faiss_index.normalize_index_config(index_config)  # 配置有误时直接报错，不写入数据库
+        status = super().update_index_config(index_config)
+        vs_item = self.load_vector_store()
+        with vs_item.acquire() as vs:
+            vs_item.index_config = index_config
+            faiss_index.apply_search_params(vs.index, index_config)  # nprobe、efSearch 立即生效
+        return status
+
+    def build_index(self):
+        self.load_vector_store().build_index(get_kb_index_config(self.kb_name))
+
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
-        with self.load_vector_store().acquire() as vs:
+        with self.load_vector_store().acquire(shared=True) as vs:
+            if isinstance(vs.docstore, SqliteDocstore):
+                return vs.docstore._dict.get_many(ids)
             return [vs.docstore._dict.get(id) for id in ids]
 
     def del_doc_by_ids(self, ids: List[str]) -> bool:
-        with self.load_vector_store().acquire() as vs:
-            vs.delete(ids)
+        self.load_vector_store().delete(ids)
 
     def do_init(self):
         self.vector_name = self.vector_name or self.embed_model
@@ -64,40 +83,58 @@ class FaissKBService(KBService):
                   ) -> List[Tuple[Document, float]]:
         embed_func = EmbeddingsFunAdapter(self.embed_model)
         embeddings = embed_func.embed_query(query)
-        with self.load_vector_store().acquire() as vs:
-            docs = vs.similarity_search_with_score_by_vector(embeddings, k=top_k, score_threshold=score_threshold)
-        return docs
+        # 不使用 FAISS.similarity_search_with_score_by_vector：HNSW 中已删除的向量需要跳过
+        return self.load_vector_store().search_batch([embeddings], k=top_k, score_threshold=score_threshold)[0]
+
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float = SCORE_THRESHOLD,
+                        ) -> List[List[Tuple[Document, float]]]:
+        embed_func = EmbeddingsFunAdapter(self.embed_model)
+        embeddings = embed_func.embed_queries(queries) # 所有查询只做一次向量化
+        return self.load_vector_store().search_batch(embeddings, k=top_k, score_threshold=score_threshold)
 
     def do_add_doc(self,
                    docs: List[Document],
                    **kwargs,
                    ) -> List[Dict]:
         data = self._docs_to_embeddings(docs) # 将向量化单独出来可以减少向量库的锁定时间
-
-        with self.load_vector_store().acquire() as vs:
-            ids = vs.add_embeddings(text_embeddings=zip(data["texts"], data["embeddings"]),
-                                    metadatas=data["metadatas"],
-                                    ids=kwargs.get("ids"))
-            if not kwargs.get("not_refresh_vs_cache"):
-                vs.save_local(self.vs_path)
-        doc_infos = [{"id": id, "metadata": doc.metadata} for id, doc in zip(ids, docs)]
+        doc_infos = self.do_add_embeddings(docs, data["embeddings"], **kwargs)
         torch_gc()
         return doc_infos
 
+    def do_add_embeddings(self,
+                          docs: List[Document],
+                          embeddings: np.ndarray,
+                          **kwargs,
+                          ) -> List[Dict]:
+        vs_item = self.load_vector_store()
+        ids = vs_item.add_embeddings(texts=[doc.page_content for doc in docs],
+                                     embeddings=embeddings,
+                                     metadatas=[doc.metadata for doc in docs],
+                                     ids=kwargs.get("ids"))
+        if not kwargs.get("not_refresh_vs_cache"):
+            vs_item.save_later(self.vs_path)
+        return [{"id": id, "metadata": doc.metadata} for id, doc in zip(ids, docs)]
+
     def do_delete_doc(self,
                       kb_file: KnowledgeFile,
                       **kwargs):
-        with self.load_vector_store().acquire() as vs:
-            ids = [k for k, v in vs.docstore._dict.items() if v.metadata.get("source").lower() == kb_file.filename.lower()]
+        vs_item = self.load_vector_store()
+        with vs_item.acquire():
+            ids = vs_item.ids_by_source(kb_file.filename)
             if len(ids) > 0:
-                vs.delete(ids)
-            if not kwargs.get("not_refresh_vs_cache"):
-                vs.save_local(self.vs_path)
+                vs_item.delete(ids)
+        # 与 do_add_embeddings 相同在锁外调用：FAISS_SAVE_DELAY <= 0 时会立即保存，持有锁时与并发的保存按相反顺序加锁而死锁
+        if not kwargs.get("not_refresh_vs_cache"):
+            vs_item.save_later(self.vs_path)
         return ids
 
     def do_clear_vs(self):
         with kb_faiss_pool.atomic:
             kb_faiss_pool.pop((self.kb_name, self.vector_name))
+            faiss_persister.discard((self.kb_name, self.vector_name))
         try:
             shutil.rmtree(self.vs_path)
         except Exception:
@@ -19,14 +19,14 @@ class MilvusKBService(KBService):
         return Collection(milvus_name)
 
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
-        result = []
-        if self.milvus.col:
+        found = {}
+        if self.milvus.col and ids:
             # ids = [int(id) for id in ids]  # for milvus if needed #pr 2725
             data_list = self.milvus.col.query(expr=f'pk in {ids}', output_fields=["*"])
             for data in data_list:
                 text = data.pop("text")
-                result.append(Document(page_content=text, metadata=data))
-        return result
+                found[str(data.get("pk"))] = Document(page_content=text, metadata=data)
+        return [found.get(str(id)) for id in ids]
 
     def del_doc_by_ids(self, ids: List[str]) -> bool:
         self.milvus.col.delete(expr=f'pk in {ids}')
@@ -27,11 +27,13 @@ class PGKBService(KBService):
                                   connection_string=kbs_config.get("pg").get("connection_uri"))
 
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
+        if not ids:
+            return []
         with Session(PGKBService.engine) as session:
-            stmt = text("SELECT document, cmetadata FROM langchain_pg_embedding WHERE collection_id in :ids")
-            results = [Document(page_content=row[0], metadata=row[1]) for row in
-                       session.execute(stmt, {'ids': ids}).fetchall()]
-            return results
+            stmt = text("SELECT custom_id, document, cmetadata FROM langchain_pg_embedding WHERE custom_id = ANY(:ids)")
+            found = {row[0]: Document(page_content=row[1], metadata=row[2]) for row in
+                     session.execute(stmt, {'ids': list(ids)}).fetchall()}
+            return [found.get(id) for id in ids]
     def del_doc_by_ids(self, ids: List[str]) -> bool:
         return super().del_doc_by_ids(ids)
 
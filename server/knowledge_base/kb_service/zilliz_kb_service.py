@@ -17,14 +17,14 @@ class ZillizKBService(KBService):
         return Collection(zilliz_name)
 
     def get_doc_by_ids(self, ids: List[str]) -> List[Document]:
-        result = []
-        if self.zilliz.col:
+        found = {}
+        if self.zilliz.col and ids:
             # ids = [int(id) for id in ids]  # for zilliz if needed #pr 2725
             data_list = self.zilliz.col.query(expr=f'pk in {ids}', output_fields=["*"])
             for data in data_list:
                 text = data.pop("text")
-                result.append(Document(page_content=text, metadata=data))
-        return result
+                found[str(data.get("pk"))] = Document(page_content=text, metadata=data)
+        return [found.get(str(id)) for id in ids]
 
     def del_doc_by_ids(self, ids: List[str]) -> bool:
         self.zilliz.col.delete(expr=f'pk in {ids}')
@@ -6,6 +6,7 @@ from configs import (
 
 from abc import ABC, abstractmethod
 from server.knowledge_base.kb_cache.faiss_cache import kb_faiss_pool, ThreadSafeFaiss
+import numpy as np
 import os
 import shutil
 from server.db.repository.knowledge_metadata_repository import add_summary_to_db, delete_summary_from_db
@@ -46,9 +47,15 @@ class KBSummaryService(ABC):
                                                create=True)
 
     def add_kb_summary(self, summary_combine_docs: List[Document]):
-        with self.load_vector_store().acquire() as vs:
-            ids = vs.add_documents(documents=summary_combine_docs)
-            vs.save_local(self.vs_path)
+        vs_item = self.load_vector_store()
+        texts = [doc.page_content for doc in summary_combine_docs]
+        with vs_item.acquire(shared=True) as vs:
+            embeddings = vs._embed_documents(texts)
+        # 通过 ThreadSafeFaiss 写入，按 label 保存的索引不支持 FAISS.add_documents 的按位置追加
+        ids = vs_item.add_embeddings(texts=texts,
+                                     embeddings=np.array(embeddings, dtype=np.float32),
+                                     metadatas=[doc.metadata for doc in summary_combine_docs])
+        vs_item.save(self.vs_path)
 
         summary_infos = [{"summary_context": doc.page_content,
                           "summary_id": id,
@@ -9,6 +9,7 @@ from server.knowledge_base.utils import (
     KnowledgeFile
 )
 from server.knowledge_base.kb_service.base import KBServiceFactory
+from server.knowledge_base.ingest import IngestPipeline
 from server.db.models.conversation_model import ConversationModel
 from server.db.models.message_model import MessageModel
 from server.db.repository.knowledge_file_repository import add_file_to_db # ensure Models are imported
@@ -23,11 +24,33 @@ from typing import Literal, List
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+
+def add_missing_columns():
+    """
+    create_all 不会修改已存在的表。为旧版本 info.db 中的表补上新增的列（如 knowledge_base.index_config），
+    新增的列均允许为空，无需重新导入数据
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                    logger.info(f"已为表 {table.name} 添加列 {column.name}")
 
 
 def reset_tables():
     Base.metadata.drop_all(bind=engine)
     create_tables()
+    KBServiceFactory.invalidate()
 
 
 def import_from_db(
@@ -101,16 +124,14 @@ def folder2db(
     """
 
     def files2vs(kb_name: str, kb_files: List[KnowledgeFile]):
-        for success, result in files2docs_in_thread(kb_files,
-                                                    chunk_size=chunk_size,
-                                                    chunk_overlap=chunk_overlap,
-                                                    zh_title_enhance=zh_title_enhance):
+        pipeline = IngestPipeline(kb,
+                                  chunk_size=chunk_size,
+                                  chunk_overlap=chunk_overlap,
+                                  zh_title_enhance=zh_title_enhance)
+        for success, result in pipeline.run(kb_files):
             if success:
-                _, filename, docs = result
-                print(f"正在将 {kb_name}/{filename} 添加到向量库，共包含{len(docs)}条文档")
-                kb_file = KnowledgeFile(filename=filename, knowledge_base_name=kb_name)
-                kb_file.splited_docs = docs
-                kb.add_doc(kb_file=kb_file, not_refresh_vs_cache=True)
+                _, filename, docs_count = result
+                print(f"已将 {kb_name}/{filename} 添加到向量库，共包含{docs_count}条文档")
             else:
                 print(result)
 
@@ -126,6 +147,7 @@ def folder2db(
             kb.create_kb()
             kb_files = file_to_kbfile(kb_name, list_files_from_folder(kb_name))
             files2vs(kb_name, kb_files)
+            kb.build_index()
             kb.save_vector_store()
         # # 不做文件内容的向量化，仅将文件元信息存到数据库
         # # 由于现在数据库存了很多与文本切分相关的信息，单纯存储文件信息意义不大，该功能取消。
@@ -9,8 +9,13 @@ from configs import (
     text_splitter_dict,
     LLM_MODELS,
     TEXT_SPLITTER_NAME,
+    PARSE_PROCESS_WORKERS,
 )
 import importlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from text_splitter import zh_title_enhance as func_zh_title_enhance
 import langchain.document_loaders
 from langchain.docstore.document import Document
@@ -329,6 +334,35 @@ class KnowledgeFile:
         self.splited_docs = docs
         return self.splited_docs
 
+    def pages2texts(
+            self,
+            zh_title_enhance: bool = ZH_TITLE_ENHANCE,
+            chunk_size: int = CHUNK_SIZE,
+            chunk_overlap: int = OVERLAP_SIZE,
+            text_splitter: TextSplitter = None,
+    ):
+        '''
+        逐页加载 PDF，每页解析完成后立即切分，切分与后续页的解析同时进行。片段不跨页，metadata 中带有页码
+        '''
+        if text_splitter is None:
+            text_splitter = make_text_splitter(splitter_name=self.text_splitter_name, chunk_size=chunk_size,
+                                               chunk_overlap=chunk_overlap)
+        loader = get_loader(loader_name=self.document_loader_name,
+                            file_path=self.filepath,
+                            loader_kwargs=self.loader_kwargs)
+        logger.info(f"{self.document_loader_name} used for {self.filepath}")
+        docs = []
+        for page in loader.lazy_load():
+            docs.extend(text_splitter.split_documents([page]))
+
+        if not docs:
+            return []
+
+        print(f"文档切分示例：{docs[0]}")
+        if zh_title_enhance:
+            docs = func_zh_title_enhance(docs)
+        return docs
+
     def file2text(
             self,
             zh_title_enhance: bool = ZH_TITLE_ENHANCE,
@@ -338,6 +372,13 @@ class KnowledgeFile:
             text_splitter: TextSplitter = None,
     ):
         if self.splited_docs is None or refresh:
+            if (self.document_loader_name == "RapidOCRPDFLoader"
+                    and self.text_splitter_name != "MarkdownHeaderTextSplitter"):
+                self.splited_docs = self.pages2texts(zh_title_enhance=zh_title_enhance,
+                                                     chunk_size=chunk_size,
+                                                     chunk_overlap=chunk_overlap,
+                                                     text_splitter=text_splitter)
+                return self.splited_docs
             docs = self.file2docs()
             self.splited_docs = self.docs2texts(docs=docs,
                                                 zh_title_enhance=zh_title_enhance,
@@ -399,8 +440,129 @@ def files2docs_in_thread(
         except Exception as e:
             yield False, (kb_name, filename, str(e))
 
-    for result in run_in_thread_pool(func=file2docs, params=kwargs_list):
-        yield result
+    if PARSE_PROCESS_WORKERS > 0 and parse_pool_usable():
+        yield from files2docs_in_process(kwargs_list)
+    else:
+        for result in run_in_thread_pool(func=file2docs, params=kwargs_list):
+            yield result
+
+
+_parse_pool: ProcessPoolExecutor = None
+_parse_pool_lock = threading.Lock()
+_parse_pool_unusable_logged = False
+
+
+def subprocess_unavailable_reason() -> str:
+    '''
+    当前进程不能创建子进程的原因，可以创建时返回空字符串。
+    startup.py 以 daemon 进程运行 API 服务，multiprocessing 不允许 daemon 进程创建子进程
+    '''
+    if multiprocessing.current_process().daemon:
+        return f"当前进程 {multiprocessing.current_process().name} 为 daemon 进程，不能创建子进程"
+    return ""
+
+
+def parse_pool_usable() -> bool:
+    '''
+    PARSE_PROCESS_WORKERS 只在可以创建子进程的进程中生效（如 init_database.py 等命令行入口），否则使用线程池解析
+    '''
+    global _parse_pool_unusable_logged
+    reason = subprocess_unavailable_reason()
+    if reason and not _parse_pool_unusable_logged:
+        logger.warning(f"{reason}，PARSE_PROCESS_WORKERS 不生效，改用线程池解析文件")
+        _parse_pool_unusable_logged = True
+    return not reason
+
+
+def _init_parse_worker():
+    '''
+    解析进程启动时标记当前进程为解析进程，预先导入文档加载器并创建默认的分词器，第一个文件不必等待导入与模型加载
+    '''
+    try:
+        from document_loaders import mypdfloader
+        mypdfloader.mark_parse_worker()
+        make_text_splitter(splitter_name=TEXT_SPLITTER_NAME)
+    except Exception as e:
+        logger.warning(f"解析进程预热失败：{e}")
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    '''
+    进程内共享的解析进程池，进程在多次入库之间复用。使用 spawn 方式启动，不继承主进程中的线程与锁
+    '''
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESS_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"),
+                                              initializer=_init_parse_worker)
+        return _parse_pool
+
+
+def _discard_parse_pool(pool: ProcessPoolExecutor):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False)
+
+
+def _file2docs_task(kb_name: str, filename: str, loader_kwargs: Dict, **kwargs) -> List[Document]:
+    # 在解析进程中运行，只传递可以 pickle 的参数，返回切分后的 Document
+    file = KnowledgeFile(filename=filename, knowledge_base_name=kb_name, loader_kwargs=loader_kwargs)
+    return file.file2text(**kwargs)
+
+
+def files2docs_in_process(kwargs_list: List[Dict]) -> Generator:
+    '''
+    与 files2docs_in_thread 相同，但在进程池中解析，不受 GIL 限制。
+    进程异常退出时进程池中所有未完成的任务都会失败，这些文件换用新的进程池逐个重试，只有导致退出的文件报错
+    '''
+    def task_args(kwargs: Dict) -> Tuple[str, str, Dict, Dict]:
+        kwargs = dict(kwargs)
+        file: KnowledgeFile = kwargs.pop("file")
+        return file.kb_name, file.filename, file.loader_kwargs, kwargs
+
+    def error(kb_name: str, filename: str, e: Exception) -> Tuple[bool, Tuple[str, str, str]]:
+        msg = f"从文件 {kb_name}/{filename} 加载文档时出错：{e}"
+        logger.error(f'{e.__class__.__name__}: {msg}',
+                     exc_info=e if log_verbose else None)
+        return False, (kb_name, filename, msg)
+
+    futures = {}
+    for kwargs in kwargs_list:
+        kb_name, filename, loader_kwargs, kw = task_args(kwargs)
+        try:
+            pool = get_parse_pool()
+            future = pool.submit(_file2docs_task, kb_name, filename, loader_kwargs, **kw)
+        except Exception as e:
+            # 进程池无法创建或已关闭，该文件报告失败，不影响其他文件
+            yield error(kb_name, filename, RuntimeError(f"无法提交到解析进程：{e}"))
+            continue
+        futures[future] = (kb_name, filename, loader_kwargs, kw)
+    broken = []
+    for future in as_completed(futures):
+        kb_name, filename, loader_kwargs, kw = futures[future]
+        try:
+            yield True, (kb_name, filename, future.result())
+        except BrokenProcessPool:
+            broken.append(futures[future])
+        except Exception as e:
+            yield error(kb_name, filename, e)
+
+    if broken:
+        _discard_parse_pool(pool)
+        for kb_name, filename, loader_kwargs, kw in broken:
+            pool = None
+            try:
+                pool = get_parse_pool()
+                yield True, (kb_name, filename,
+                             pool.submit(_file2docs_task, kb_name, filename, loader_kwargs, **kw).result())
+            except BrokenProcessPool as e:
+                _discard_parse_pool(pool)
+                yield error(kb_name, filename, RuntimeError(f"解析进程异常退出：{e}"))
+            except Exception as e:
+                yield error(kb_name, filename, e)
 
 
 if __name__ == "__main__":
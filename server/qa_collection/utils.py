@@ -9,6 +9,7 @@ from configs import (
     logger,
 )
 from server.knowledge_base.kb_service.base import KBService
+from server.knowledge_base.kb_cache.base import search_result_cache
 from askadmin.db.models import QA
 
 
@@ -18,8 +19,12 @@ def qa_to_document(qa: QA) -> Document:
         - source: collection_d
         - question: question
         - answer: answer
+        - alias: alias
         - qa_id: id of QA if applied
 
+    askserver's `/qa/query` answers straight from this metadata, so keep it in
+    sync with the QA record by re-vectorizing whenever question/answer/alias change.
+
     The default strategy for chosing content for embedding is: the `alias`
     field will be used for embedding. If `alias` field is empty, the `question`
     field will be used instead.
@@ -32,6 +37,7 @@ def qa_to_document(qa: QA) -> Document:
         "source": qa.collection.id,
         "question": qa.question,
         "answer": qa.answer,
+        "alias": qa.alias,
         "qa_id": qa.id,
     }
     return Document(
@@ -52,6 +58,7 @@ def vectorize_multiple(
         - source: collection_d
         - question: question
         - answer: answer
+        - alias: alias
         - qa_id: id of QA if applied
     3. Embed these `Document` objects
     4. Insert these `Document` objects to vector store
@@ -63,6 +70,7 @@ def vectorize_multiple(
     if ZH_TITLE_ENHANCE:
         qa_docs = text_splitter.zh_title_enhance(qa_docs)
     id_and_docs = kb.do_add_doc(qa_docs)
+    search_result_cache.invalidate(kb.kb_name)
     # save doc_id to qas
     # NOTE: id_and_doc will automatically convert qa_id to str
     qa_id_map = {str(qa.id): qa for qa in qa_list}
@@ -102,9 +110,9 @@ def delete_docs_by_id(kb: KBService, doc_ids: List[str]):
             doc_ids = [int(pk) for pk in doc_ids]
             kb.milvus.col.delete(expr=f"pk in {doc_ids}")
     elif isinstance(kb, FaissKBService):
-        with kb.load_vector_store().acquire() as vs:
-            vs.delete(doc_ids)
+        kb.load_vector_store().delete(doc_ids)
     elif isinstance(kb, PGKBService):
         kb.pg_vector.delete(doc_ids)
     else:
         raise NotImplementedError()
+    search_result_cache.invalidate(kb.kb_name)
@@ -3,7 +3,6 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from typing import Any, List, Optional
-from sentence_transformers import CrossEncoder
 from typing import Optional, Sequence
 from langchain_core.documents import Document
 from langchain.callbacks.manager import Callbacks
@@ -46,7 +45,11 @@ class LangchainReranker(BaseDocumentCompressor):
         # self.activation_fct=activation_fct
         # self.apply_softmax=apply_softmax
 
-        self._model = CrossEncoder(model_name=model_name_or_path, max_length=1024, device=device)
+        # CrossEncoder 由 reranker_pool 统一缓存，避免每次请求都从磁盘重新加载模型权重
+        from server.knowledge_base.kb_cache.base import reranker_pool
+        self._model = reranker_pool.load_reranker(model_name_or_path=model_name_or_path,
+                                                  device=device,
+                                                  max_length=max_length)
         super().__init__(
             top_n=top_n,
             model_name_or_path=model_name_or_path,
@@ -6,8 +6,11 @@ from pathlib import Path
 import asyncio
 from configs import (LLM_MODELS, LLM_DEVICE, EMBEDDING_DEVICE,
                      MODEL_PATH, MODEL_ROOT_PATH, ONLINE_LLM_MODEL, logger, log_verbose,
-                     FSCHAT_MODEL_WORKERS, HTTPX_DEFAULT_TIMEOUT)
+                     FSCHAT_MODEL_WORKERS, HTTPX_DEFAULT_TIMEOUT,
+                     RETRIEVAL_EXECUTOR_WORKERS, RETRIEVAL_EXECUTOR_QUEUE_SIZE)
 import os
+import functools
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain.chat_models import ChatOpenAI
 from langchain.llms import OpenAI
@@ -30,12 +33,81 @@ import torch
 from server.minx_chat_openai import MinxChatOpenAI
 
 from askadmin.db.models import KnowledgeBase
+from playhouse.signals import post_save, post_delete
 from asksjtu_prompt import format_prompt_template
-from configs.asksjtu_config import DEFAULT_PROMPT_TEMPLATE
+from configs.asksjtu_config import DEFAULT_PROMPT_TEMPLATE, KB_PROMPT_CACHE_TTL
+import time
 
 thread_pool = ThreadPoolExecutor(os.cpu_count())
 
 
+class BoundedExecutor:
+    '''
+    有界线程池：最多 max_workers 个任务同时运行，max_queue_size 个任务排队，
+    超出的调用在事件循环中异步等待而不是无限堆积。stats() 返回当前的队列深度等指标。
+    '''
+    def __init__(self, max_workers: int, max_queue_size: int, name: str = "executor"):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+
+    def _call(self, func: Callable) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        '''
+        在线程池中运行 func(*args, **kwargs) 并等待结果
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers + self.max_queue_size)
+        with self._lock:
+            self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        try:
+            with self._lock:
+                self._queued += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, self._call, functools.partial(func, *args, **kwargs))
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "running": self._running,
+                "queued": self._queued,
+                "waiting": self._waiting,
+                "completed": self._completed,
+            }
+
+
+retrieval_executor = BoundedExecutor(RETRIEVAL_EXECUTOR_WORKERS,
+                                     RETRIEVAL_EXECUTOR_QUEUE_SIZE,
+                                     name="retrieval")
+
+
 async def wrap_done(fn: Awaitable, event: asyncio.Event):
     """Wrap an awaitable with a event to signal when it's done or an exception is raised."""
     try:
@@ -446,37 +518,79 @@ def webui_address() -> str:
     return f"http://{host}:{port}"
 
 
+_prompt_config_lock = threading.Lock()
+_prompt_config_mtime: Optional[float] = None
+
+
 def get_default_prompt_template(type: str, prompt_name: str) -> Optional[str]:
     '''
     从prompt_config中加载模板内容
     type: "llm_chat","agent_chat","knowledge_base_chat","search_engine_chat"的其中一种，如果有新功能，应该进行加入。
     '''
-
+    global _prompt_config_mtime
     from configs import prompt_config
     import importlib
-    importlib.reload(prompt_config)  # TODO: 检查configs/prompt_config.py文件有修改再重新加载
+    try:
+        mtime = os.path.getmtime(prompt_config.__file__)
+    except OSError:
+        mtime = None
+    if mtime != _prompt_config_mtime:  # 只在 configs/prompt_config.py 有修改时重新加载
+        with _prompt_config_lock:
+            if mtime != _prompt_config_mtime:
+                importlib.reload(prompt_config)
+                _prompt_config_mtime = mtime
     return prompt_config.PROMPT_TEMPLATES[type].get(prompt_name)
 
 
+# kb_name -> (缓存时间, 知识库自定义提示语)
+_kb_prompt_cache: Dict[str, Tuple[float, Optional[str]]] = {}
+
+
+def get_kb_prompt(kb_name: str) -> Optional[str]:
+    '''
+    获取知识库的自定义提示语，知识库不存在或未设置时返回 None
+    '''
+    item = _kb_prompt_cache.get(kb_name)
+    if item is not None and time.time() - item[0] <= KB_PROMPT_CACHE_TTL:
+        return item[1]
+    kb = KnowledgeBase.get_or_none(name=kb_name)
+    prompt = kb.prompt if kb is not None and kb.prompt else None
+    _kb_prompt_cache[kb_name] = (time.time(), prompt)
+    return prompt
+
+
+def clear_kb_prompt_cache(kb_name: str = None):
+    if kb_name is None:
+        _kb_prompt_cache.clear()
+    else:
+        _kb_prompt_cache.pop(kb_name, None)
+
+
+@post_save(sender=KnowledgeBase)
+def _on_kb_saved(model_class, instance: KnowledgeBase, created: bool):
+    clear_kb_prompt_cache(instance.name)
+
+
+@post_delete(sender=KnowledgeBase)
+def _on_kb_deleted(model_class, instance: KnowledgeBase):
+    clear_kb_prompt_cache(instance.name)
+
+
 def get_prompt_template(type: str, prompt_name: str, kb_name: Optional[str] = None) -> Optional[str]:
     '''
     尝试从数据库中获取自定义模板，如果不存在则从prompt_config中加载模板内容
     '''
-    if kb_name is None:
-        return format_prompt_template(
-            get_default_prompt_template(type, prompt_name)
-        )
     # fetch prompt command from kb
-    kb = KnowledgeBase.get_or_none(name=kb_name)
+    command = get_kb_prompt(kb_name) if kb_name is not None else None
     # if KB does not exist or the prompt is empty
-    if kb is None or not kb.prompt:
+    if command is None:
         return format_prompt_template(
             get_default_prompt_template(type, prompt_name)
         )
     # else
     return format_prompt_template(
         DEFAULT_PROMPT_TEMPLATE,
-        command=kb.prompt,
+        command=command,
     )
 
 
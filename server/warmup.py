@@ -0,0 +1,140 @@
+from configs import (EMBEDDING_MODEL, MODEL_PATH, USE_RERANKER, RERANKER_MODEL, RERANKER_MAX_LENGTH,
+                     WARMUP_ENABLED, WARMUP_KNOWLEDGE_BASES, WARMUP_EMBED_MODELS, WARMUP_QUERY, WARMUP_WORKERS,
+                     CACHED_VS_NUM,
+                     logger, log_verbose)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
+import threading
+import time
+
+
+class WarmupManager:
+    '''
+    服务启动时在后台线程中并行预加载 embedding 模型、知识库向量库与 reranker，并对每一项执行一次检索，
+    使第一个请求不必承担模型加载与向量库读取的耗时。预热完成前 /health 返回 503，负载均衡据此只转发到已预热的实例
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None
+        self._started_at: float = None
+        self._finished_at: float = None
+        # 预热项名称 -> {"status": "pending" | "ok" | "error", "seconds": float, "error": str}
+        self._items: Dict[str, Dict] = {}
+
+    @property
+    def ready(self) -> bool:
+        return not WARMUP_ENABLED or self._finished_at is not None
+
+    def start(self):
+        '''
+        启动后台预热，不阻塞服务启动。重复调用不会重复预热
+        '''
+        with self._lock:
+            if not WARMUP_ENABLED or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        self._started_at = time.time()
+        try:
+            tasks = self._collect_tasks()
+            self._items.update({name: {"status": "pending"} for name, _ in tasks})
+            logger.info(f"开始预热：{', '.join(self._items)}")
+            with ThreadPoolExecutor(max(1, WARMUP_WORKERS), thread_name_prefix="warmup") as pool:
+                futures = {pool.submit(self._run_task, func): name for name, func in tasks}
+                for future in as_completed(futures):
+                    self._items[futures[future]] = future.result()
+        except Exception as e:
+            logger.error(f"{e.__class__.__name__}: 预热失败：{e}", exc_info=e if log_verbose else None)
+        finally:
+            # 预热出错时同样标记为完成，/health 不会一直返回 503
+            self._finished_at = time.time()
+        logger.info(f"预热完成，用时 {self._finished_at - self._started_at:.1f} 秒")
+
+    @staticmethod
+    def _run_task(func: Callable) -> Dict:
+        start = time.perf_counter()
+        try:
+            func()
+            return {"status": "ok", "seconds": time.perf_counter() - start}
+        except Exception as e:
+            logger.error(f"{e.__class__.__name__}: 预热失败：{e}", exc_info=e if log_verbose else None)
+            return {"status": "error", "seconds": time.perf_counter() - start, "error": str(e)}
+
+    def _collect_tasks(self) -> List[Tuple[str, Callable]]:
+        from server.db.repository.knowledge_base_repository import list_kbs_from_db
+
+        kb_names = WARMUP_KNOWLEDGE_BASES or []
+        if isinstance(kb_names, str):
+            kb_names = [kb_names]
+        if "*" in kb_names:
+            try:
+                kb_names = list_kbs_from_db()
+            except Exception as e:
+                logger.error(f"{e.__class__.__name__}: 读取知识库列表失败：{e}", exc_info=e if log_verbose else None)
+                self._items["kb:*"] = {"status": "error", "seconds": 0, "error": str(e)}
+                kb_names = [name for name in kb_names if name != "*"]
+        kb_names = list(dict.fromkeys(kb_names))
+        if CACHED_VS_NUM > 0 and len(kb_names) > CACHED_VS_NUM:
+            # 超出向量库缓存容量的知识库加载后会立即被后面的知识库挤出缓存，预热没有意义
+            skipped = kb_names[CACHED_VS_NUM:]
+            kb_names = kb_names[:CACHED_VS_NUM]
+            logger.warning(f"向量库缓存最多保留 {CACHED_VS_NUM} 个知识库（CACHED_VS_NUM），跳过预热：{', '.join(skipped)}")
+            self._items.update({f"kb:{name}": {"status": "skipped", "seconds": 0} for name in skipped})
+        tasks = [(f"embed:{model}", lambda model=model: warmup_embeddings(model))
+                 for model in dict.fromkeys(WARMUP_EMBED_MODELS or [EMBEDDING_MODEL])]
+        tasks += [(f"kb:{name}", lambda name=name: warmup_knowledge_base(name)) for name in kb_names]
+        if USE_RERANKER:
+            tasks.append((f"reranker:{RERANKER_MODEL}", warmup_reranker))
+        return tasks
+
+    def status(self) -> Dict:
+        if not WARMUP_ENABLED:
+            state = "ready"
+        elif self._finished_at is not None:
+            state = "ready"
+        elif self._started_at is not None:
+            state = "warming"
+        else:
+            state = "pending"
+        return {
+            "status": state,
+            "started_at": self._started_at,
+            "finished_at": self._finished_at,
+            "items": dict(self._items),
+        }
+
+
+def warmup_embeddings(embed_model: str):
+    from server.embeddings_api import embed_texts
+
+    resp = embed_texts([WARMUP_QUERY], embed_model=embed_model, to_query=True)
+    if resp.code != 200:
+        raise RuntimeError(resp.msg)
+
+
+def warmup_knowledge_base(kb_name: str):
+    '''
+    加载知识库使用的 embedding 模型与向量库，并执行一次检索，使 mmap 的索引页被读入内存
+    '''
+    from server.knowledge_base.kb_service.base import KBServiceFactory
+
+    kb = KBServiceFactory.get_service_by_name(kb_name)
+    if kb is None:
+        raise RuntimeError(f"未找到知识库 {kb_name}")
+    kb.search_docs(WARMUP_QUERY, top_k=1)
+
+
+def warmup_reranker():
+    from server.knowledge_base.kb_cache.base import reranker_pool
+    from server.utils import embedding_device
+
+    model_path = MODEL_PATH["reranker"].get(RERANKER_MODEL, "BAAI/bge-reranker-large")
+    model = reranker_pool.load_reranker(model_name_or_path=model_path,
+                                        device=embedding_device(),
+                                        max_length=RERANKER_MAX_LENGTH)
+    model.predict([(WARMUP_QUERY, WARMUP_QUERY)])
+
+
+warmup_manager = WarmupManager()
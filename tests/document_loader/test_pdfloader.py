@@ -19,3 +19,69 @@ def test_rapidocrpdfloader():
     assert isinstance(docs, list) and len(docs) > 0 and isinstance(docs[0].page_content, str)
 
 
+
+
+def test_rapidocrpdfloader_lazy_load():
+    pdf_path = test_files["ocr_test.pdf"]
+    from document_loaders import RapidOCRPDFLoader
+
+    loader = RapidOCRPDFLoader(pdf_path)
+    pages = list(loader.lazy_load())
+    assert len(pages) > 0
+    assert [doc.metadata["page"] for doc in pages] == sorted(doc.metadata["page"] for doc in pages)
+
+
+def test_rapidocrpdfloader_parallel_matches_serial(monkeypatch):
+    pdf_path = test_files["ocr_test.pdf"]
+    from document_loaders import RapidOCRPDFLoader, mypdfloader
+
+    # 每页一个范围，保证走进程池
+    monkeypatch.setattr(mypdfloader, "PDF_PAGE_RANGE_SIZE", 1)
+    monkeypatch.setattr(mypdfloader, "PDF_PARSE_WORKERS", 0)
+    serial = list(RapidOCRPDFLoader(pdf_path).iter_pages())
+
+    monkeypatch.setattr(mypdfloader, "PDF_PARSE_WORKERS", 2)
+    assert mypdfloader.page_pool_usable()
+    ranges = [(i, i + 1) for i in range(len(serial))]
+    loader = RapidOCRPDFLoader(pdf_path)
+    try:
+        extracted = list(loader._extract_ranges(pdf_path, ranges, parallel=True))
+        assert [start for start, _ in extracted] == list(range(len(serial)))
+        # 并行失败时会丢弃进程池并改为串行，这里确认确实由进程池完成
+        assert mypdfloader._page_pool is not None
+        assert list(loader.iter_pages()) == serial
+    finally:
+        if mypdfloader._page_pool is not None:
+            mypdfloader._discard_page_pool(mypdfloader._page_pool)
+
+
+def test_rapidocrpdfloader_serial_in_parse_worker(monkeypatch):
+    pdf_path = test_files["ocr_test.pdf"]
+    from document_loaders import RapidOCRPDFLoader, mypdfloader
+
+    def fail():
+        raise AssertionError("解析进程中不应创建页码进程池")
+
+    monkeypatch.setattr(mypdfloader, "PDF_PAGE_RANGE_SIZE", 1)
+    monkeypatch.setattr(mypdfloader, "get_page_pool", fail)
+    monkeypatch.setattr(mypdfloader, "_in_parse_worker", True)
+    assert mypdfloader.page_pool_unavailable_reason()
+    assert len(list(RapidOCRPDFLoader(pdf_path).iter_pages())) > 0
+
+
+def test_rapidocrpdfloader_extract_error_keeps_pool(tmp_path, monkeypatch):
+    import pytest
+    from document_loaders import RapidOCRPDFLoader, mypdfloader
+
+    monkeypatch.setattr(mypdfloader, "PDF_PARSE_WORKERS", 2)
+    pdf_path = tmp_path / "broken.pdf"
+    pdf_path.write_bytes(b"not a pdf")
+    loader = RapidOCRPDFLoader(str(pdf_path))
+    pool = mypdfloader.get_page_pool()
+    try:
+        # 文件本身出错时直接报告失败，不丢弃其它文件正在使用的进程池
+        with pytest.raises(Exception):
+            list(loader._extract_ranges(str(pdf_path), [(0, 1), (1, 2)], parallel=True))
+        assert mypdfloader._page_pool is pool
+    finally:
+        mypdfloader._discard_page_pool(pool)
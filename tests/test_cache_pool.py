@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+from server.knowledge_base.kb_cache.base import CachePool, ThreadSafeObject
+
+
+class SizedObject(ThreadSafeObject):
+    def __init__(self, key, size):
+        super().__init__(key)
+        self._size = size
+
+    def size_bytes(self) -> int:
+        return self._size
+
+
+def fill(pool, sizes):
+    for key, size in sizes.items():
+        pool.record_lookup(key, hit=False)
+        item = pool.set(key, SizedObject(key, size))
+        item.finish_loading()
+    pool._check_count()  # 与 KBFaissPool 相同，加载完成后按实际大小再检查一次
+
+
+def test_evict_by_bytes_lru():
+    pool = CachePool(max_bytes=100)
+    fill(pool, {"a": 40, "b": 40})
+    pool.get("a")  # b 成为最久未使用的
+    fill(pool, {"c": 40})
+    assert pool.keys() == ["a", "c"]
+    assert pool.stats()["evictions"] == 1
+
+
+def test_evict_lfu_and_pinned():
+    pool = CachePool(cache_num=2, policy="lfu")
+    pool.pin("a")
+    fill(pool, {"a": 0, "b": 0})
+    pool.record_lookup("b", hit=True)
+    fill(pool, {"c": 0})
+    assert pool.keys() == ["a", "c"]  # 固定的对象不会被淘汰
+
+
+def test_last_inserted_is_kept():
+    pool = CachePool(max_bytes=10)
+    fill(pool, {"big": 100})
+    assert pool.keys() == ["big"]
+    stats = pool.stats()
+    assert stats["misses"] == 1 and stats["hit_rate"] == 0.0
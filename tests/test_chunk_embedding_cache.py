@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+
+from server.embeddings_api import ChunkEmbeddingCache
+
+
+def test_get_many_and_persistence(tmp_path):
+    path = str(tmp_path / "chunks.sqlite")
+    cache = ChunkEmbeddingCache(path=path)
+    cache.set_many("bge", ["选课", "校园卡"], np.array([[0.6, 0.8], [1.0, 0.0]]))
+
+    # 新实例从同一文件读取，模拟服务重启
+    cache = ChunkEmbeddingCache(path=path)
+    result = cache.get_many("bge", ["校园卡", "图书馆", "选课", "校园卡"])
+    assert result[1] is None
+    np.testing.assert_allclose(result[0], [1.0, 0.0])
+    np.testing.assert_allclose(result[2], [0.6, 0.8])
+    assert result[3] is not None
+    assert cache.get_many("m3e", ["选课"]) == [None]
+    assert cache.stats()["hits"] == 3
+
+
+def test_evict_least_recently_used(tmp_path):
+    # 每个 2 维向量 8 字节，最多 10 个
+    cache = ChunkEmbeddingCache(path=str(tmp_path / "chunks.sqlite"), max_bytes=80, touch_interval=0)
+    for i in range(10):
+        cache.set_many("bge", [f"t{i}"], np.zeros((1, 2)))
+    cache.get_many("bge", ["t0"])
+    cache.set_many("bge", ["t10"], np.zeros((1, 2)))
+    assert cache.stats()["size"] == 9
+    assert cache.stats()["bytes"] == 72
+    assert cache.get_many("bge", ["t0"])[0] is not None
+    assert cache.get_many("bge", ["t1"])[0] is None
+
+
+def test_disabled_without_path():
+    cache = ChunkEmbeddingCache(path="")
+    cache.set_many("bge", ["a"], np.zeros((1, 2)))
+    assert cache.get_many("bge", ["a"]) == [None]
+
+
+def test_recent_hits_do_not_write(tmp_path):
+    cache = ChunkEmbeddingCache(path=str(tmp_path / "chunks.sqlite"), touch_interval=3600)
+    cache.set_many("bge", ["选课"], np.zeros((1, 2)))
+    changes = cache._conn.total_changes
+    for _ in range(3):
+        assert cache.get_many("bge", ["选课"])[0] is not None
+    assert cache._conn.total_changes == changes
@@ -0,0 +1,125 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from server.knowledge_base.kb_cache import faiss_index
+
+
+def random_vectors(n, d=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "ivf_pq"])
+def test_build_and_remove_keep_labels(monkeypatch, index_type):
+    monkeypatch.setattr(faiss_index, "FAISS_IVF_MIN_VECTORS", 500)
+    vectors = random_vectors(2000)
+    labels = np.arange(2000) * 2  # label 不必连续
+    config = {"type": index_type, "nlist": 16, "nprobe": 16, "m": 8}
+    index = faiss_index.build_index(32, config, vectors, labels)
+    assert index.ntotal == 2000
+    assert faiss_index.is_id_mapped(index)
+
+    # 删除后其余向量的 label 不变；HNSW 只做标记，由 ThreadSafeFaiss 在检索时跳过
+    faiss_index.remove_labels(index, [0, 2, 4])
+    _, ids = index.search(vectors[3:4], 10)
+    assert 6 in ids[0]  # ivf_pq 为近似检索，不要求排在第一
+    if index_type == "hnsw":
+        assert index.ntotal == 2000
+        index = faiss_index.compact(index, labels[3:])
+    assert index.ntotal == 1997
+    _, ids = index.search(vectors[3:4], 10)
+    assert not {0, 2, 4} & set(ids[0])
+    if index_type != "ivf_pq":
+        np.testing.assert_allclose(faiss_index.reconstruct_labels(index, [6, 3998]), vectors[[3, 1999]], atol=1e-6)
+
+
+def test_positional_index_converted_in_place():
+    vectors = random_vectors(10)
+    index = faiss.IndexFlatL2(32)
+    index.add(vectors)
+    assert not faiss_index.is_id_mapped(index)
+    mapped = faiss_index.to_id_mapped(index)
+    faiss_index.remove_labels(mapped, [0])
+    _, ids = mapped.search(vectors[9:10], 1)
+    assert ids[0][0] == 9
+
+
+def test_small_ivf_stays_flat(monkeypatch):
+    monkeypatch.setattr(faiss_index, "FAISS_IVF_MIN_VECTORS", 500)
+    index = faiss_index.build_index(32, {"type": "ivf_flat"}, random_vectors(100))
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+
+
+def test_invalid_type():
+    with pytest.raises(ValueError):
+        faiss_index.normalize_index_config({"type": "lsh"})
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_scores_keep_l2_semantics_after_build(index_type):
+    pytest.importorskip("langchain")
+    from langchain.docstore.in_memory import InMemoryDocstore
+    from langchain.vectorstores.faiss import FAISS
+    from server.knowledge_base.kb_cache.faiss_cache import ThreadSafeFaiss
+
+    # 与 new_vector_store 相同：IndexFlatL2 + distance_strategy="METRIC_INNER_PRODUCT"，分数越小越相关
+    vs = FAISS(embedding_function=None, index=faiss.IndexFlatL2(2), docstore=InMemoryDocstore(),
+               index_to_docstore_id={}, normalize_L2=True, distance_strategy="METRIC_INNER_PRODUCT")
+    item = ThreadSafeFaiss("test")
+    item.obj = vs
+    item.finish_loading()
+    item.add_embeddings(texts=["near", "middle", "far"],
+                        embeddings=np.array([[1, 0.1], [1, 1], [-1, 0]], dtype=np.float32))
+
+    def search():
+        with item.acquire(shared=True) as vs:
+            return [(doc.page_content, score)
+                    for doc, score in vs.similarity_search_with_score_by_vector([1.0, 0.0], k=3, score_threshold=1.0)]
+
+    before = search()
+    assert [text for text, _ in before] == ["near", "middle"]  # far 的距离为 4，超过阈值
+    assert before[0][1] < before[1][1]
+
+    item.build_index({"type": index_type})
+    after = search()
+    assert [text for text, _ in after] == ["near", "middle"]
+    np.testing.assert_allclose([s for _, s in after], [s for _, s in before], rtol=1e-4, atol=1e-5)
+    assert [text for text, _ in item.search_batch([[1.0, 0.0]], k=3, score_threshold=1.0)[0]] == ["near", "middle"]
+
+
+def test_hnsw_deletes_are_skipped_then_compacted(monkeypatch):
+    pytest.importorskip("langchain")
+    from langchain.docstore.in_memory import InMemoryDocstore
+    from langchain.vectorstores.faiss import FAISS
+    from server.knowledge_base.kb_cache import faiss_cache
+
+    monkeypatch.setattr(faiss_cache, "FAISS_HNSW_REBUILD_RATIO", 0.5)
+    config = {"type": "hnsw"}
+    vs = FAISS(embedding_function=None, index=faiss_index.new_index(32, config), docstore=InMemoryDocstore(),
+               index_to_docstore_id={}, normalize_L2=True, distance_strategy="METRIC_INNER_PRODUCT")
+    item = faiss_cache.ThreadSafeFaiss("test")
+    item.obj = vs
+    item.index_config = config
+    item.finish_loading()
+    vectors = random_vectors(20)
+    item.add_embeddings(texts=[str(i) for i in range(20)], embeddings=vectors, ids=[str(i) for i in range(20)])
+
+    item.delete([str(i) for i in range(5)])
+    assert vs.index.ntotal == 20  # 只做标记
+    results = item.search_batch(vectors[:5], k=3)
+    assert all(len(row) == 3 and not {doc.page_content for doc, _ in row} & set("01234") for row in results)
+
+    item.delete([str(i) for i in range(5, 10)])  # 标记占比达到 0.5，重建
+    assert vs.index.ntotal == 10
+    item.add_embeddings(texts=["new"], embeddings=vectors[:1], ids=["new"])
+    assert item.search_batch(vectors[:1], k=1)[0][0][0].page_content == "new"
+    assert sorted(vs.index_to_docstore_id) == list(range(10, 21))
@@ -0,0 +1,130 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import os
+
+import faiss
+import numpy as np
+import pytest
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores.faiss import FAISS
+
+from server.knowledge_base.kb_cache import faiss_cache
+from server.knowledge_base.kb_cache.sqlite_docstore import SqliteDocstore
+
+
+def make_vs() -> faiss_cache.ThreadSafeFaiss:
+    vs = FAISS(embedding_function=None, index=faiss.IndexFlatL2(2), docstore=InMemoryDocstore(),
+               index_to_docstore_id={}, normalize_L2=True)
+    item = faiss_cache.ThreadSafeFaiss("test")
+    item.obj = vs
+    item.finish_loading()
+    item.add_embeddings(texts=["a", "b"], embeddings=np.array([[1, 0], [0, 1]], dtype=np.float32), ids=["1", "2"])
+    return item
+
+
+def test_save_switches_version_atomically(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_cache, "FAISS_DOCSTORE_FORMAT", "sqlite")
+    (tmp_path / "index.faiss").write_bytes(b"legacy")  # 旧格式的文件在第一次保存后删除
+    item = make_vs()
+    item.save(str(tmp_path))
+    first = faiss_cache.current_vs_dir(str(tmp_path))
+    assert os.path.isfile(os.path.join(first, "index.faiss"))
+    assert os.path.isfile(os.path.join(first, SqliteDocstore.filename))
+    assert not (tmp_path / "index.faiss").exists()
+
+    item.delete(["1"])
+    item.save(str(tmp_path))
+    second = faiss_cache.current_vs_dir(str(tmp_path))
+    assert second != first and not os.path.exists(first)
+
+    # 切换 CURRENT 之前出错，仍然读取完整的旧版本
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(faiss_cache, "_atomic_write", fail)
+    item.delete(["2"])
+    with pytest.raises(OSError):
+        item.save(str(tmp_path))
+    assert faiss_cache.current_vs_dir(str(tmp_path)) == second
+    assert [name for name in os.listdir(tmp_path) if name.startswith(faiss_cache.VERSION_PREFIX)] == \
+           [os.path.basename(second)]
+
+
+def test_verify_detects_mismatch():
+    item = make_vs()
+    with item.acquire() as vs:
+        faiss_cache.verify_vector_store("test", vs)
+        del vs.docstore._dict["1"]
+        with pytest.raises(RuntimeError):
+            faiss_cache.verify_vector_store("test", vs)
+
+
+def load_saved(tmp_path, item) -> faiss_cache.ThreadSafeFaiss:
+    item.save(str(tmp_path))
+    loaded = faiss_cache.ThreadSafeFaiss("loaded")
+    loaded.obj = faiss_cache.kb_faiss_pool.load_sqlite_vector_store(
+        loaded, faiss_cache.current_vs_dir(str(tmp_path)), None)
+    loaded.finish_loading()
+    return loaded
+
+
+def test_mmap_only_for_ivf(tmp_path, monkeypatch):
+    from server.knowledge_base.kb_cache import faiss_index
+    monkeypatch.setattr(faiss_cache, "FAISS_DOCSTORE_FORMAT", "sqlite")
+    monkeypatch.setattr(faiss_cache, "FAISS_MMAP_INDEX", True)
+    monkeypatch.setattr(faiss_index, "FAISS_IVF_MIN_VECTORS", 100)
+
+    # flat 索引不能 mmap，按普通方式完整加载
+    flat = load_saved(tmp_path / "flat", make_vs())
+    assert flat._mmap_path is None
+
+    item = make_vs()
+    vectors = np.random.default_rng(0).standard_normal((200, 2)).astype(np.float32)
+    item.add_embeddings(texts=[str(i) for i in range(200)], embeddings=vectors)
+    item.build_index({"type": "ivf_flat", "nlist": 4})
+    ivf = load_saved(tmp_path / "ivf", item)
+    assert ivf._mmap_path is not None
+    assert faiss_index.invlists_on_disk(ivf.obj.index)
+
+
+def test_loaded_flat_index_counts_toward_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_cache, "FAISS_DOCSTORE_FORMAT", "sqlite")
+    monkeypatch.setattr(faiss_cache, "FAISS_MMAP_INDEX", True)
+    item = make_vs()
+    vectors = np.random.default_rng(0).standard_normal((1000, 2)).astype(np.float32)
+    item.add_embeddings(texts=[""] * 1000, embeddings=vectors)
+    loaded = load_saved(tmp_path, item)
+    index = loaded.obj.index
+    assert index.ntotal == 1002
+    # 常驻内存的 flat 索引计入缓存预算
+    assert loaded.size_bytes() >= index.ntotal * index.d * 4 + 1002 * 200
+
+
+def test_failed_load_is_not_cached(tmp_path, monkeypatch):
+    import threading
+    monkeypatch.setattr(faiss_cache, "FAISS_DOCSTORE_FORMAT", "pickle")
+    item = make_vs()
+    with item.acquire() as vs:
+        del vs.docstore._dict["1"]  # 索引与 docstore 不一致
+    item.save(str(tmp_path))
+
+    pool = faiss_cache.KBFaissPool(cache_num=2)
+    monkeypatch.setattr(faiss_cache, "get_vs_path", lambda kb_name, vector_name: str(tmp_path))
+    monkeypatch.setattr(faiss_cache, "get_kb_index_config", lambda kb_name: None)
+    monkeypatch.setattr(pool, "load_kb_embeddings", lambda **kwargs: None)
+
+    errors = []
+    def load_twice():
+        for _ in range(2):
+            try:
+                pool.load_vector_store("broken", "test")
+            except RuntimeError as e:
+                errors.append(e)
+    t = threading.Thread(target=load_twice, daemon=True)
+    t.start()
+    t.join(timeout=10)
+    assert not t.is_alive() and len(errors) == 2
+    assert pool.keys() == []
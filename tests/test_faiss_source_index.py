@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores.faiss import FAISS
+
+from server.knowledge_base.kb_cache.faiss_cache import ThreadSafeFaiss
+
+
+def make_vs() -> ThreadSafeFaiss:
+    vs = FAISS(embedding_function=None,
+               index=faiss.IndexFlatIP(2),
+               docstore=InMemoryDocstore(),
+               index_to_docstore_id={},
+               normalize_L2=True)
+    item = ThreadSafeFaiss("test")
+    item.obj = vs
+    item.finish_loading()
+    return item
+
+
+def test_ids_by_source_and_delete():
+    item = make_vs()
+    item.add_embeddings(texts=["a", "b", "c"],
+                        embeddings=np.array([[1, 0], [0, 1], [1, 1]], dtype=np.float32),
+                        metadatas=[{"source": "a.md"}, {"source": "B.md"}, {"source": "a.md"}],
+                        ids=["1", "2", "3"])
+    assert sorted(item.ids_by_source("A.md")) == ["1", "3"]
+    assert item.ids_by_source("b.md") == ["2"]
+
+    assert sorted(item.delete(item.ids_by_source("a.md"))) == ["1", "3"]
+    assert item.ids_by_source("a.md") == []
+    with item.acquire() as vs:
+        assert vs.index.ntotal == 1
+        assert vs.index_to_docstore_id == {1: "2"}  # 删除后其余向量的 label 不变
+
+    # 删除后继续添加，label 不与已有的重复，检索结果对应正确的文档
+    item.add_embeddings(texts=["d"], embeddings=np.array([[1, 0]], dtype=np.float32),
+                        metadatas=[{"source": "d.md"}], ids=["4"])
+    with item.acquire() as vs:
+        assert vs.index_to_docstore_id == {1: "2", 3: "4"}
+        docs = vs.similarity_search_with_score_by_vector([1.0, 0.0], k=2)
+        assert [doc.page_content for doc, _ in docs] == ["d", "b"]
+
+
+def test_source_index_rebuilt_after_external_change():
+    item = make_vs()
+    item.add_embeddings(texts=["a"], embeddings=np.array([[1, 0]], dtype=np.float32),
+                        metadatas=[{"source": "a.md"}], ids=["1"])
+    with item.acquire() as vs:
+        vs.add_embeddings(text_embeddings=[("b", [0.0, 1.0])], metadatas=[{"source": "b.md"}], ids=["2"])
+    assert item.ids_by_source("b.md") == ["2"]
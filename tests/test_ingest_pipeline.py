@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from server.knowledge_base import ingest
+
+
+class FakeKB:
+    kb_name = "samples"
+    accepts_embeddings = True
+
+    def __init__(self):
+        self.batches = []
+        self.deleted = []
+
+    def relative_sources(self, docs):
+        pass
+
+    def _docs_to_embeddings(self, docs):
+        return {"embeddings": np.zeros((len(docs), 2), dtype=np.float32)}
+
+    def do_add_embeddings(self, docs, embeddings, **kwargs):
+        self.batches.append(len(docs))
+        return [{"id": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+    def delete_doc(self, kb_file, **kwargs):
+        self.deleted.append(kb_file.filename)
+
+
+def fake_files2docs(files, **kwargs):
+    for name, count in files:
+        if count < 0:
+            yield False, ("samples", name, "解析失败")
+        else:
+            yield True, ("samples", name, [Document(page_content=f"{name}-{i}") for i in range(count)])
+
+
+def patch_ingest(monkeypatch, files2docs) -> dict:
+    recorded = {}
+    monkeypatch.setattr(ingest, "files2docs_in_thread", files2docs)
+    monkeypatch.setattr(ingest.IngestPipeline, "_file_name", staticmethod(lambda file: file[0]))
+    monkeypatch.setattr(ingest, "KnowledgeFile",
+                        lambda filename, knowledge_base_name: type("F", (), {"filename": filename,
+                                                                              "kb_name": knowledge_base_name}))
+    monkeypatch.setattr(ingest, "add_file_to_db",
+                        lambda kb_file, docs_count, doc_infos, **kw: recorded.update({kb_file.filename: docs_count}))
+    return recorded
+
+
+def test_batches_span_files(monkeypatch):
+    recorded = patch_ingest(monkeypatch, fake_files2docs)
+
+    kb = FakeKB()
+    pipeline = ingest.IngestPipeline(kb, batch_size=4)
+    results = list(pipeline.run([("a.md", 3), ("bad.pdf", -1), ("b.md", 6), ("empty.txt", 0)]))
+
+    assert kb.batches == [4, 4, 1]  # 9 个片段跨文件组成固定大小的批次
+    assert recorded == {"a.md": 3, "b.md": 6}
+    assert sorted(r[1][1] for r in results) == ["a.md", "b.md", "bad.pdf", "empty.txt"]
+    assert sorted(r[1][1] for r in results if not r[0]) == ["bad.pdf", "empty.txt"]  # 与 add_doc 相同，空文件为失败
+    assert sorted(kb.deleted) == ["a.md", "b.md"]
+
+
+def test_parse_crash_reports_outstanding_files(monkeypatch):
+    def crashing_files2docs(files, **kwargs):
+        yield True, ("samples", "a.md", [Document(page_content=f"a-{i}") for i in range(6)])
+        raise RuntimeError("worker died")
+
+    recorded = patch_ingest(monkeypatch, crashing_files2docs)
+    results = list(ingest.IngestPipeline(FakeKB(), batch_size=4).run([("a.md", 6), ("b.md", 2)]))
+
+    # b.md 没有收到解析结果，同样报告失败
+    assert recorded == {"a.md": 6}
+    assert sorted((r[0], r[1][1]) for r in results) == [(True, "a.md"), (False, "b.md")]
+    assert "worker died" in [r for r in results if not r[0]][0][1][2]
+
+
+def test_embed_crash_cleans_partial_files(monkeypatch):
+    recorded = patch_ingest(monkeypatch, fake_files2docs)
+    kb = FakeKB()
+
+    def relative_sources(docs):
+        if docs[0].page_content.startswith("b"):
+            raise RuntimeError("bad metadata")
+    kb.relative_sources = relative_sources
+    results = list(ingest.IngestPipeline(kb, batch_size=4).run([("a.md", 6), ("b.md", 2)]))
+
+    # a.md 只写入了 4 个片段，删除已写入的片段后报告失败
+    assert recorded == {}
+    assert sorted((r[0], r[1][1]) for r in results) == [(False, "a.md"), (False, "b.md")]
+    assert kb.deleted == ["a.md", "a.md"]
+
+
+def test_closing_run_early_stops_threads(monkeypatch):
+    patch_ingest(monkeypatch, fake_files2docs)
+    pipeline = ingest.IngestPipeline(FakeKB(), batch_size=1, queue_size=1)
+    results = pipeline.run([(f"{i}.md", 3) for i in range(20)])
+    assert next(results)[0]
+    results.close()  # 如客户端断开
+
+    for t in pipeline._threads:
+        t.join(timeout=5)
+    assert not any(t.is_alive() for t in pipeline._threads)
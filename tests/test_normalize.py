@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+
+from server.knowledge_base.kb_service.base import normalize
+
+
+def test_normalize_list_input():
+    vectors = normalize([[3.0, 4.0], [0.0, 2.0]])
+    assert vectors.dtype == np.float32
+    assert vectors.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0.0, 1.0]], rtol=1e-6)
+
+
+def test_normalize_float32_in_place():
+    embeddings = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32)
+    vectors = normalize(embeddings)
+    # 已经是 float32 连续矩阵时不应产生副本
+    assert vectors is embeddings
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0.0, 0.0]], rtol=1e-6)
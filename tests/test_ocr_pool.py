@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+
+from document_loaders import ocr
+
+
+class FakeOCR:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        return [[None, f"{image.shape[1]}x{image.shape[0]}", 1.0]], None
+
+
+def test_ocr_images_keep_order_and_cache(monkeypatch):
+    engines = []
+    monkeypatch.setattr(ocr, "get_ocr", lambda: engines.append(FakeOCR()) or engines[-1])
+
+    pool = ocr.OCRPool(size=2, cache_size=16)
+    logo = np.full((40, 30, 3), 255, dtype=np.uint8)
+    images = [np.zeros((10, 20, 3), dtype=np.uint8), logo, logo.copy(), np.zeros((50, 60, 3), dtype=np.uint8)]
+    texts = pool.ocr_images(images)
+
+    assert texts == ["20x10", "30x40", "30x40", "60x50"]
+    assert len(engines) <= 2
+    # 第二次识别相同的图片全部命中缓存
+    calls = sum(e.calls for e in engines)
+    assert pool.ocr_images(images) == texts
+    assert sum(e.calls for e in engines) == calls
+
+
+def test_same_size_images_do_not_share_text(monkeypatch):
+    class PixelOCR:
+        def __call__(self, image):
+            return [[None, str(int(image[0, 0, 0])), 1.0]], None
+
+    monkeypatch.setattr(ocr, "get_ocr", PixelOCR)
+    pool = ocr.OCRPool(size=1, cache_size=16)
+    # 两张纯色图片尺寸相同、9x8 差值哈希也相同（全 0），但内容不同
+    dark = np.full((64, 64, 3), 10, dtype=np.uint8)
+    light = np.full((64, 64, 3), 200, dtype=np.uint8)
+    assert pool.ocr_images([dark, light, dark.copy()]) == ["10", "200", "10"]
+    assert pool.hits == 1
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import multiprocessing
+from types import SimpleNamespace
+
+from server.knowledge_base import utils
+
+
+def test_daemon_process_cannot_use_parse_pool(monkeypatch):
+    monkeypatch.setattr(multiprocessing.current_process(), "daemon", True)
+    assert "daemon" in utils.subprocess_unavailable_reason()
+    assert not utils.parse_pool_usable()
+
+
+def test_submit_failure_reports_each_file(monkeypatch):
+    def broken_pool():
+        raise AssertionError("daemonic processes are not allowed to have children")
+    monkeypatch.setattr(utils, "get_parse_pool", broken_pool)
+
+    files = [SimpleNamespace(kb_name="samples", filename=name, loader_kwargs={}) for name in ("a.md", "b.pdf")]
+    results = list(utils.files2docs_in_process([{"file": f, "chunk_size": 250} for f in files]))
+    assert [(status, name) for status, (_, name, _) in results] == [(False, "a.md"), (False, "b.pdf")]
+    assert all("daemonic" in msg for _, (_, _, msg) in results)
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import numpy as np
+
+from server.embeddings_api import QueryEmbeddingCache
+
+
+def test_cache_hit_and_whitespace_normalization():
+    cache = QueryEmbeddingCache(max_size=2)
+    cache.set("bge", "选课 时间", np.array([0.6, 0.8]))
+    assert cache.get("bge", "  选课   时间 ") is not None
+    assert cache.get("m3e", "选课 时间") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_lru_and_ttl_eviction():
+    cache = QueryEmbeddingCache(max_size=2)
+    cache.set("bge", "a", np.zeros(2))
+    cache.set("bge", "b", np.zeros(2))
+    cache.get("bge", "a")
+    cache.set("bge", "c", np.zeros(2))
+    assert cache.get("bge", "b") is None
+    assert cache.get("bge", "a") is not None
+
+    cache = QueryEmbeddingCache(max_size=2, ttl=-1)
+    cache.set("bge", "a", np.zeros(2))
+    assert cache.get("bge", "a") is None
+
+
+def test_cache_persistence(tmp_path):
+    path = str(tmp_path / "query_cache.pkl")
+    cache = QueryEmbeddingCache(max_size=2, path=path)
+    cache.set("bge", "校园卡", np.array([1.0, 0.0]))
+    cache.save()
+
+    restored = QueryEmbeddingCache(max_size=2, path=path)
+    np.testing.assert_allclose(restored.get("bge", "校园卡"), [1.0, 0.0])
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+from server.knowledge_base.kb_service.base import reciprocal_rank_fusion
+from server.knowledge_base.model.kb_document_model import DocumentWithVSId
+
+
+def make_doc(id: str, score: float) -> DocumentWithVSId:
+    return DocumentWithVSId(page_content=f"content of {id}", id=id, score=score)
+
+
+def test_rrf_deduplicates_by_id():
+    results = [
+        [make_doc("a", 0.2), make_doc("b", 0.4)],
+        [make_doc("b", 0.3), make_doc("c", 0.5)],
+        [make_doc("a", 0.1)],
+    ]
+    docs = reciprocal_rank_fusion(results)
+    assert [d.id for d in docs] == ["a", "b", "c"]
+    # keep the best score for duplicated chunks
+    assert docs[0].score == 0.1
+    assert docs[1].score == 0.3
+
+
+def test_rrf_without_id_falls_back_to_content():
+    results = [
+        [DocumentWithVSId(page_content="same", score=0.5)],
+        [DocumentWithVSId(page_content="same", score=0.4)],
+    ]
+    docs = reciprocal_rank_fusion(results)
+    assert len(docs) == 1 and docs[0].score == 0.4
+
+
+def test_rrf_empty():
+    assert reciprocal_rank_fusion([]) == []
+    assert reciprocal_rank_fusion([[], []]) == []
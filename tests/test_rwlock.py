@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+import pytest
+
+from server.knowledge_base.kb_cache.base import RWLock
+
+
+def test_shared_holders_run_concurrently():
+    lock = RWLock()
+    barrier = threading.Barrier(3, timeout=2)
+
+    def reader():
+        lock.acquire_shared()
+        try:
+            barrier.wait()  # 三个线程必须同时持有共享锁才能通过
+        finally:
+            lock.release_shared()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert lock.stats()["shared_acquires"] == 3
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    order = []
+    lock.acquire_shared()
+
+    def writer():
+        lock.acquire_exclusive()
+        order.append("writer")
+        lock.release_exclusive()
+
+    def reader():
+        lock.acquire_shared()
+        order.append("reader")
+        lock.release_shared()
+
+    w = threading.Thread(target=writer)
+    w.start()
+    while lock.stats()["waiting_writers"] == 0:
+        time.sleep(0.01)
+    r = threading.Thread(target=reader)
+    r.start()
+    time.sleep(0.05)
+    assert order == []
+    lock.release_shared()
+    w.join()
+    r.join()
+    assert order == ["writer", "reader"]
+    assert lock.stats()["exclusive_waits"] == 1
+
+
+def test_reentrancy():
+    lock = RWLock()
+    lock.acquire_exclusive()
+    lock.acquire_exclusive()
+    lock.acquire_shared()
+    lock.release_shared()
+    lock.release_exclusive()
+    lock.release_exclusive()
+    assert lock.stats()["writer"] is False
+
+    lock.acquire_shared()
+    with pytest.raises(RuntimeError):
+        lock.acquire_exclusive()
+    lock.release_shared()
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+from server.knowledge_base.kb_cache.base import SearchResultCache
+
+
+def test_search_result_cache_hit():
+    cache = SearchResultCache(max_size=8)
+    key = cache.make_key("samples", "bge", "如何选课", 3, 1.0)
+    assert cache.get(key) is None
+    cache.set(key, [("doc", 0.1)])
+    assert cache.get(cache.make_key("samples", "bge", " 如何选课 ", 3, 1.0)) == [("doc", 0.1)]
+    assert cache.get(cache.make_key("samples", "bge", "如何选课", 5, 1.0)) is None
+
+
+def test_search_result_cache_invalidate():
+    cache = SearchResultCache(max_size=8)
+    key = cache.make_key("samples", "bge", "如何选课", 3, 1.0)
+    other = cache.make_key("other", "bge", "如何选课", 3, 1.0)
+    cache.set(key, [("doc", 0.1)])
+    cache.set(other, [("doc", 0.2)])
+    cache.invalidate("samples")
+    assert cache.get(cache.make_key("samples", "bge", "如何选课", 3, 1.0)) is None
+    assert cache.get(other) == [("doc", 0.2)]
+
+    # 检索开始后知识库被修改，旧版本的结果不应写入缓存
+    stale = cache.make_key("samples", "bge", "校园卡", 3, 1.0)
+    cache.invalidate("samples")
+    cache.set(stale, [("doc", 0.3)])
+    assert cache.get(cache.make_key("samples", "bge", "校园卡", 3, 1.0)) is None
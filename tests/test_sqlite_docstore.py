@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+from server.knowledge_base.kb_cache.sqlite_docstore import SqliteDocstore
+
+
+def make_docstore(tmp_path) -> SqliteDocstore:
+    source = InMemoryDocstore({
+        "a": Document(page_content="选课", metadata={"source": "A.md", "page": 1}),
+        "b": Document(page_content="校园卡", metadata={"source": "b.md"}),
+    })
+    path = str(tmp_path / SqliteDocstore.filename)
+    SqliteDocstore.dump(source, {0: "a", 1: "b"}, path)
+    return SqliteDocstore(path)
+
+
+def test_lazy_read(tmp_path):
+    docstore = make_docstore(tmp_path)
+    assert len(docstore._dict) == 2
+    assert docstore.search("a").page_content == "选课"
+    assert docstore.search("a").metadata["page"] == 1
+    assert isinstance(docstore.search("c"), str)
+    assert docstore._dict.index_to_docstore_id() == {0: "a", 1: "b"}
+    assert sorted(docstore._dict.source_items()) == [("a", "a.md"), ("b", "b.md")]
+
+
+def test_overlay_and_reopen(tmp_path):
+    docstore = make_docstore(tmp_path)
+    docstore.add({"c": Document(page_content="图书馆", metadata={"source": "c.md"})})
+    docstore.delete(["a"])
+    assert len(docstore._dict) == 2
+    assert "a" not in docstore._dict
+    assert [k for k, _ in docstore._dict.items()] == ["b", "c"]
+
+    path = str(tmp_path / "new.sqlite")
+    SqliteDocstore.dump(docstore, {0: "b", 1: "c"}, path)
+    docstore.reopen(path)
+    assert len(docstore._dict) == 2
+    assert docstore.search("c").page_content == "图书馆"
+
+
+def test_get_many(tmp_path):
+    docstore = make_docstore(tmp_path)
+    docstore.add({"c": Document(page_content="图书馆", metadata={"source": "c.md"})})
+    docstore.delete(["a"])
+    docs = docstore._dict.get_many(["c", "a", "b", "x"], chunk_size=1)
+    assert [d.page_content if d else None for d in docs] == ["图书馆", None, "校园卡", None]
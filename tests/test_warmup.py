@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent
+sys.path.append(str(root_path))
+
+from server import warmup
+from server.db.repository import knowledge_base_repository
+
+
+def test_star_in_list_expands_and_errors_finish(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_ENABLED", True)
+    monkeypatch.setattr(warmup, "USE_RERANKER", False)
+    monkeypatch.setattr(warmup, "CACHED_VS_NUM", -1)
+    monkeypatch.setattr(warmup, "warmup_embeddings", lambda model: None)
+    warmed = []
+    monkeypatch.setattr(warmup, "warmup_knowledge_base", warmed.append)
+
+    monkeypatch.setattr(warmup, "WARMUP_KNOWLEDGE_BASES", ["*"])
+    monkeypatch.setattr(knowledge_base_repository, "list_kbs_from_db", lambda: ["samples", "faq"])
+    manager = warmup.WarmupManager()
+    manager.run()
+    assert sorted(warmed) == ["faq", "samples"]
+    assert manager.ready
+
+    # 读取知识库列表出错时其余项照常预热，并且预热仍会结束
+    def fail():
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(warmup, "WARMUP_KNOWLEDGE_BASES", ["*", "samples"])
+    monkeypatch.setattr(knowledge_base_repository, "list_kbs_from_db", fail)
+    manager = warmup.WarmupManager()
+    manager.run()
+    assert manager.ready
+    status = manager.status()
+    assert status["items"]["kb:*"]["status"] == "error"
+    assert status["items"]["kb:samples"]["status"] == "ok"
+
+
+def test_warmup_capped_at_cache_capacity(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_ENABLED", True)
+    monkeypatch.setattr(warmup, "USE_RERANKER", False)
+    monkeypatch.setattr(warmup, "warmup_embeddings", lambda model: None)
+    warmed = []
+    monkeypatch.setattr(warmup, "warmup_knowledge_base", warmed.append)
+    monkeypatch.setattr(warmup, "WARMUP_KNOWLEDGE_BASES", ["samples", "faq", "samples"])
+    monkeypatch.setattr(warmup, "CACHED_VS_NUM", 1)
+
+    manager = warmup.WarmupManager()
+    manager.run()
+    # 缓存只能保留一个知识库，其余的跳过，不会加载后立即被释放
+    assert warmed == ["samples"]
+    assert manager.status()["items"]["kb:faq"]["status"] == "skipped"
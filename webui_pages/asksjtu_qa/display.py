@@ -53,6 +53,17 @@ def diff_qa_dict_list(
     return diff
 
 
+def content_changed(origin_qa_dict: Dict, updated_qa: Dict) -> bool:
+    """
+    Whether alias/question/answer changed, all of which are stored in the vector store
+    """
+    return (
+        origin_qa_dict["alias"] != updated_qa[ZH_ALIAS]
+        or origin_qa_dict["question"] != updated_qa[ZH_QUESTION]
+        or origin_qa_dict["answer"] != updated_qa[ZH_ANSWER]
+    )
+
+
 def update_qas(
     collection: QACollection,
     df: pd.DataFrame,
@@ -87,10 +98,7 @@ def update_qas(
     to_remove = []
     for updated_qa in diff:
         origin_qa_dict = origin_qa_id_map[updated_qa["ID"]]
-        if (
-            origin_qa_dict["vectorized"]
-            and origin_qa_dict["alias"] != updated_qa[ZH_ALIAS]
-        ):
+        if origin_qa_dict["vectorized"] and content_changed(origin_qa_dict, updated_qa):
             to_remove.append(updated_qa["ID"])
             continue
         if not origin_qa_dict["vectorized"]:
@@ -109,7 +117,7 @@ def update_qas(
         if not origin_qa_dict["vectorized"]:
             to_add.append(updated_qa["ID"])
             continue
-        if origin_qa_dict["alias"] != updated_qa[ZH_ALIAS]:
+        if content_changed(origin_qa_dict, updated_qa):
             to_add.append(updated_qa["ID"])
             continue
 
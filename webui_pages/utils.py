@@ -577,6 +577,29 @@ class ApiRequest:
         )
         return self._get_response_value(response, as_json=True)
 
+    def search_kb_docs_batch(
+            self,
+            knowledge_base_name: str,
+            queries: List[str],
+            top_k: int = VECTOR_SEARCH_TOP_K,
+            score_threshold: int = SCORE_THRESHOLD,
+    ) -> List:
+        '''
+        对应api.py/knowledge_base/search_docs_batch接口
+        '''
+        data = {
+            "queries": queries,
+            "knowledge_base_name": knowledge_base_name,
+            "top_k": top_k,
+            "score_threshold": score_threshold,
+        }
+
+        response = self.post(
+            "/knowledge_base/search_docs_batch",
+            json=data,
+        )
+        return self._get_response_value(response, as_json=True)
+
     def update_docs_by_id(
             self,
             knowledge_base_name: str,